@@ -1,4 +1,8 @@
+import math
+import os
+
 import customtkinter as ctk
+import numpy as np
 import tkinter
 from PIL import Image, ImageTk
 from tkinter import ttk
@@ -14,17 +18,34 @@ image_size = 40
 border_width = 1
 button_size = image_size + border_width * 8
 LFO_button_size = int(button_size / 2)
+# the images and theme are next to this file, so it doesn't matter where the synth is run from.
+here = os.path.dirname(os.path.abspath(__file__))
+assets = os.path.join(here, "assets")
 # the image directories
-sin_image = "assets/sine_icon.png"
-square_image = "assets/square_icon.png"
-saw_image = "assets/saw_icon.png"
-triange_image = "assets/triangle_icon.png"
+sin_image = os.path.join(assets, "sine_icon.png")
+square_image = os.path.join(assets, "square_icon.png")
+saw_image = os.path.join(assets, "saw_icon.png")
+triange_image = os.path.join(assets, "triangle_icon.png")
 # the maximum attack, decay, and release.
 max_adr = 10
+# the oscilloscope and level meters: their size, how many decibels the meters show, and the fewest milliseconds
+# between redraws (so drawing can't take much time away from rendering).
+scope_width = 160
+scope_height = 100
+meter_width = 8
+meter_range = 60
+scope_interval = 50
+
+# custom theme. it's set when the window is made rather than on import, so importing this doesn't touch tk.
+def set_theme():
+    ctk.set_appearance_mode("Dark")
+    ctk.set_default_color_theme(os.path.join(here, "syntheme.json"))
+
 
-# custom theme
-ctk.set_appearance_mode("Dark")
-ctk.set_default_color_theme("syntheme.json")
+# how far down the canvas a level meter reaches for level (from 0 to 1), on a decibel scale.
+def meter_y(level):
+    decibels = 20 * math.log10(max(level, 1e-9))
+    return scope_height * min(max(-decibels / meter_range, 0), 1)
 
 
 # code modified from https://stackoverflow.com/questions/59642558/how-to-set-tkinter-scale-sliders-color
@@ -57,6 +78,7 @@ def make_LFO_buttons(master, command):
 
 class Window(ctk.CTk):
     def __init__(self, wave_shape=0):
+        set_theme()
         super().__init__()
         self.wave_shape = wave_shape
         self.pitch = 1
@@ -74,8 +96,8 @@ class Window(ctk.CTk):
         self.saw_image = load_image(saw_image, image_size)
         self.triange_image = load_image(triange_image, image_size)
 
-        self.img_slider = tkinter.PhotoImage(master=self, file="assets/slider_knob2.png")
-        self.img_trough = tkinter.PhotoImage(master=self, file="assets/slider_Trough.png")
+        self.img_slider = tkinter.PhotoImage(master=self, file=os.path.join(assets, "slider_knob2.png"))
+        self.img_trough = tkinter.PhotoImage(master=self, file=os.path.join(assets, "slider_Trough.png"))
         # custom slider
         self.style = ttk.Style(self)
         self.style.configure('TScale', background="#270126")
@@ -96,24 +118,29 @@ class Window(ctk.CTk):
         self.left_frame.grid(column=0, row=0, sticky="NW")
         self.attack_label = ctk.CTkLabel(self.left_frame, text="Attack")
         self.attack_label.grid(column=0, row=1)
-        self.attack_slider = ctk.CTkSlider(self.left_frame, from_=0, to=1, number_of_steps=100, width=100)
+        self.attack_slider = ctk.CTkSlider(self.left_frame, from_=0, to=1, number_of_steps=100, width=100,
+                                           command=self.onEnvelopeChanged)
         self.attack_slider.grid(column=0, row=2)
         self.decay_label = ctk.CTkLabel(self.left_frame, text="Decay")
         self.decay_label.grid(column=0, row=3)
-        self.decay_slider = ctk.CTkSlider(self.left_frame, from_=0.001, to=1, number_of_steps=100, width=100)
+        self.decay_slider = ctk.CTkSlider(self.left_frame, from_=0.001, to=1, number_of_steps=100, width=100,
+                                          command=self.onEnvelopeChanged)
         self.decay_slider.grid(column=0, row=4)
         self.sustain_label = ctk.CTkLabel(self.left_frame, text="Sustain")
         self.sustain_label.grid(column=0, row=5)
-        self.sustain_slider = ctk.CTkSlider(self.left_frame, from_=0, to=1, number_of_steps=100, width=100)
+        self.sustain_slider = ctk.CTkSlider(self.left_frame, from_=0, to=1, number_of_steps=100, width=100,
+                                            command=self.onEnvelopeChanged)
         self.sustain_slider.grid(column=0, row=6)
         self.release_label = ctk.CTkLabel(self.left_frame, text="Release")
         self.release_label.grid(column=0, row=7)
-        self.release_slider = ctk.CTkSlider(self.left_frame, from_=0, to=1, number_of_steps=100, width=100)
+        self.release_slider = ctk.CTkSlider(self.left_frame, from_=0, to=1, number_of_steps=100, width=100,
+                                            command=self.onEnvelopeChanged)
         self.release_slider.grid(column=0, row=8)
 
-        # the middle top frame - empty?
+        # the middle top frame, where the scope goes (see start_scope)
         self.mid_frame = ctk.CTkFrame(self)
         self.mid_frame.grid(column=1, row=0, sticky="nswe")
+        self.scope_tap = None
 
         # the top right frame, which houses the wave shape buttons and amp/pitch sldiers.
         self.right_frame = ctk.CTkFrame(self, width=panel_size)
@@ -178,6 +205,44 @@ class Window(ctk.CTk):
         self.period1_entry = ctk.CTkEntry(self.period1_frame, width=100, textvariable=self.period1)
         self.period1_entry.grid(column=0, row=1)  # stick defines which side of the grid it will be at
 
+    # an oscilloscope and a level meter for each channel in the middle frame, fed from tap (a Scope.ScopeTap). it's
+    # polled on tk's own timer, so the render thread never waits for the gui, and only redrawn when there's been a new
+    # block. the meters are the rms level, with a line for the peak.
+    def start_scope(self, tap):
+        self.scope_tap = tap
+        self.scope_wave = np.zeros(tap.points)
+        self.scope_peak = np.zeros(tap.channels)
+        self.scope_rms = np.zeros(tap.channels)
+        self.scope_canvas = tkinter.Canvas(self.mid_frame, width=scope_width + tap.channels * (meter_width + 2),
+                                           height=scope_height, bg="#270126", highlightthickness=0)
+        self.scope_canvas.grid(column=0, row=0, padx=5, pady=5)
+        # the line's x, y pairs. only the ys change.
+        self.scope_coords = np.zeros(2 * tap.points)
+        self.scope_coords[0::2] = np.linspace(0, scope_width, tap.points)
+        self.scope_coords[1::2] = scope_height / 2
+        self.scope_line = self.scope_canvas.create_line(*self.scope_coords.tolist(), fill="white")
+        self.scope_meters = []
+        for channel in range(tap.channels):
+            left = scope_width + 2 + channel * (meter_width + 2)
+            rms = self.scope_canvas.create_rectangle(left, scope_height, left + meter_width, scope_height,
+                                                     fill="#864dac", width=0)
+            peak = self.scope_canvas.create_line(left, scope_height, left + meter_width, scope_height, fill="white")
+            self.scope_meters.append((left, rms, peak))
+        self.after(scope_interval, self.draw_scope)
+
+    def draw_scope(self):
+        if self.scope_tap.read(self.scope_wave, self.scope_peak, self.scope_rms):
+            canvas = self.scope_canvas
+            half = scope_height / 2
+            np.clip(self.scope_wave, -1, 1, out=self.scope_wave)
+            self.scope_coords[1::2] = half - self.scope_wave * half
+            canvas.coords(self.scope_line, *self.scope_coords.tolist())
+            for (left, rms, peak), peak_level, rms_level in zip(self.scope_meters, self.scope_peak, self.scope_rms):
+                canvas.coords(rms, left, meter_y(rms_level), left + meter_width, scope_height)
+                y = meter_y(peak_level)
+                canvas.coords(peak, left, y, left + meter_width, y)
+        self.after(scope_interval, self.draw_scope)
+
     # logarithmically calculate these so that you can be more precise with values near 0.
     @property
     def attack(self):
@@ -210,6 +275,9 @@ class Window(ctk.CTk):
     def onAmpChanged(self, *_):
         pass
 
+    def onEnvelopeChanged(self, *_):
+        pass
+
 
     def shape_changed(self, index):
         pass
@@ -0,0 +1,266 @@
+# measures how fast the synth renders, as a real time factor (seconds of audio made per second of cpu time).
+# anything under 1 can't keep up with the sound card. it goes through every combination of voice count, wave shape,
+# modulation (an amp LFO and a pitch LFO), envelope and block size on three paths:
+#   engine: SynthEngine and its voice bank, which is what the live synth plays
+#   rend:   one ModulatedOscillator per voice, rendered a block at a time
+#   next:   one ModulatedOscillator per voice, rendered a sample at a time with __next__
+# the results are written as json. if any engine case comes in under the budget it exits with 1, so it can fail a ci
+# run before a slow down turns into dropouts.
+#
+# it also times how long the engine takes to import in a fresh interpreter, and checks that doing so doesn't load any
+# of the front ends' libraries (the gui, sound card and keyboard), which can be held to a budget too.
+#
+#   python -m Project.Benchmark --budget 4 --startup-budget 300 --output bench.json
+
+import argparse
+import functools
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from .Effects import effect_types
+from .FM import presets
+from .Engine import SynthEngine
+from .Generators import Oscillator, ModulationBus, VoicePool
+from .Tuning import equal_temperament
+
+wave_shape_names = ["sine", "square", "saw", "triangle"]
+# the MIDI note the test notes start from
+a2 = 45
+
+
+# the test notes, going up in semitones from A2.
+def _notes(voices):
+    return a2 + np.arange(voices)
+
+
+def _note_freqs(voices):
+    return equal_temperament()[_notes(voices)]
+
+
+# renders num_frames frames a block at a time, and returns how long it took.
+def _time_blocks(render_block, block_size, num_frames):
+    frames = 0
+    start = time.perf_counter()
+    while frames < num_frames:
+        render_block(block_size)
+        frames += block_size
+    return time.perf_counter() - start, frames
+
+
+def _engine_case(voices, wave_shape, modulation, adsr, sample_rate, dtype="float64", effects=(), control_interval=1,
+                 operators=None, unison=1, channels=1):
+    engine = SynthEngine(sample_rate=sample_rate, max_voices=voices, dtype=dtype,
+                         effects=[(name, {}) for name in effects], control_interval=control_interval,
+                         operators=operators, unison=unison, channels=channels)
+    engine.amp = 1
+    engine.change_shape(wave_shape)
+    if modulation:
+        engine.amp_lfos.append(0)
+        engine.pitch_lfos.append(1)
+        engine.freq_scale = 0.1
+    if not adsr:
+        engine.attack, engine.decay, engine.sustain = 0, 0, 1
+    for i, note in enumerate(_notes(voices)):
+        engine.note_on(i, note)
+    return engine.render
+
+
+# one ModulatedOscillator per voice, from a VoicePool. the LFOs are shared, either directly like the old synth did, or
+# through a ModulationBus when bus is given.
+def _oscillator_voices(voices, wave_shape, modulation, adsr, sample_rate, bus=None):
+    lfos = [Oscillator(freq=5, sample_rate=sample_rate), Oscillator(freq=3, sample_rate=sample_rate)]
+    if bus is not None:
+        bus.sources[:] = lfos
+        lfos = [bus.tap(0), bus.tap(1)]
+    pool = VoicePool(size=voices, sample_rate=sample_rate, amp_modulators=lfos[:1] if modulation else (),
+                     freq_modulators=lfos[1:] if modulation else (), freq_scale=0.1, envelopes=adsr)
+    for i, freq in enumerate(_note_freqs(voices)):
+        pool.note_on(i, freq, amp=0.2, wave_shape=wave_shape)
+    return pool.voices[:pool.count]
+
+
+def _rend_case(voices, wave_shape, modulation, adsr, sample_rate):
+    bus = ModulationBus([])
+    oscillators = _oscillator_voices(voices, wave_shape, modulation, adsr, sample_rate, bus)
+
+    def render_block(num_frames):
+        bus.advance(num_frames)
+        return sum(osc.rend(num_frames) for osc in oscillators)
+    return render_block
+
+
+def _next_case(voices, wave_shape, modulation, adsr, sample_rate):
+    oscillators = _oscillator_voices(voices, wave_shape, modulation, adsr, sample_rate)
+
+    def render_block(num_frames):
+        return [sum(next(osc) for osc in oscillators) for _ in range(num_frames)]
+    return render_block
+
+
+paths = {"engine": _engine_case, "rend": _rend_case, "next": _next_case}
+
+# the libraries only the front ends use. importing the engine shouldn't load any of them.
+frontend_modules = ("App", "customtkinter", "tkinter", "PIL", "pyaudio", "keyboard", "rtmidi")
+
+# the package's own modules (App) are checked by their name inside it
+_startup_script = """
+import sys, time
+start = time.perf_counter()
+import {package}.{module}
+print(time.perf_counter() - start)
+names = [name[len("{package}."):] if name.startswith("{package}.") else name for name in sys.modules]
+print(",".join(sorted(name for name in names if name.split(".")[0] in {frontends!r})))
+"""
+
+
+# how long a fresh interpreter takes to import module (the quickest of repeats tries, which is the one the rest of the
+# machine got in the way of least), and which of the front ends' libraries came with it.
+def startup(module="Engine", repeats=5, budget_ms=None):
+    script = _startup_script.format(package=__package__, module=module, frontends=frontend_modules)
+    # the folder the package is in, so it can be imported
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    loaded = []
+    for _ in range(repeats):
+        lines = subprocess.run([sys.executable, "-c", script], cwd=here, capture_output=True, text=True,
+                               check=True).stdout.splitlines()
+        times.append(float(lines[0]))
+        loaded = [name for name in lines[1].split(",") if name] if len(lines) > 1 else []
+    result = {
+        "module": module,
+        "import_ms": min(times) * 1000,
+        "frontends_loaded": loaded,
+    }
+    if budget_ms is not None:
+        result["passed"] = result["import_ms"] <= budget_ms and not loaded
+    return result
+
+
+
+def run(voice_counts=(1, 8, 32), block_sizes=(64, 256, 1024), wave_shapes=(0, 1, 2, 3),
+        path_names=("engine", "rend", "next"), seconds=1.0, next_seconds=0.02, sample_rate=44100, budget=None,
+        dtype="float64", effects=(), control_interval=1, operators=None, unison=1, channels=1,
+        startup_modules=("Engine",), startup_budget=None):
+    results = []
+    for path_name in path_names:
+        make_case = paths[path_name]
+        if path_name == "engine":
+            make_case = functools.partial(make_case, dtype=dtype, effects=effects, control_interval=control_interval,
+                                          operators=operators, unison=unison, channels=channels)
+        # the per sample path doesn't care about block size, and is far too slow to run for long.
+        path_block_sizes = (256,) if path_name == "next" else block_sizes
+        path_seconds = next_seconds if path_name == "next" else seconds
+        for voices, wave_shape, modulation, adsr, block_size in itertools.product(
+                voice_counts, wave_shapes, (False, True), (False, True), path_block_sizes):
+            render_block = make_case(voices, wave_shape, modulation, adsr, sample_rate)
+            # one block first, so the wavetables etc. are built before timing starts.
+            render_block(block_size)
+            elapsed, frames = _time_blocks(render_block, block_size, int(path_seconds * sample_rate))
+            rtf = (frames / sample_rate) / elapsed
+            result = {
+                "path": path_name,
+                "voices": voices,
+                "wave_shape": wave_shape_names[wave_shape],
+                "modulation": modulation,
+                "adsr": adsr,
+                "block_size": block_size,
+                "dtype": dtype if path_name == "engine" else "float64",
+                "control_interval": control_interval if path_name == "engine" else 1,
+                "fm": operators if path_name == "engine" else None,
+                "unison": unison if path_name == "engine" else 1,
+                "channels": channels if path_name == "engine" else 1,
+                "frames": frames,
+                "seconds": elapsed,
+                # how long one block takes, against the time the sound card gives it
+                "block_ms": elapsed / (frames / block_size) * 1000,
+                "deadline_ms": block_size / sample_rate * 1000,
+                "real_time_factor": rtf,
+            }
+            # the engine's effects (from Effects.effect_types, with their default settings) are timed separately too,
+            # so their share of the block can be weighed against the voices.
+            engine = getattr(render_block, "__self__", None)
+            if engine is not None and len(engine.effects):
+                result["effects"] = engine.effects.costs(block_size, sample_rate)
+            # only the engine is held to the budget, since it's the path that plays live.
+            if budget is not None and path_name == "engine":
+                result["passed"] = rtf >= budget
+            results.append(result)
+    startups = [startup(module, budget_ms=startup_budget) for module in startup_modules]
+    return {
+        "sample_rate": sample_rate,
+        "budget": budget,
+        "startup_budget_ms": startup_budget,
+        "results": results,
+        "startup": startups,
+        "passed": all(result.get("passed", True) for result in results + startups),
+    }
+
+
+def _ints(text):
+    return tuple(int(value) for value in text.split(","))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="benchmark the synth's render paths")
+    parser.add_argument("--voices", type=_ints, default=(1, 8, 32), help="comma separated voice counts")
+    parser.add_argument("--block-sizes", type=_ints, default=(64, 256, 1024), help="comma separated block sizes")
+    parser.add_argument("--shapes", type=_ints, default=(0, 1, 2, 3), help="comma separated wave shape indexes")
+    parser.add_argument("--paths", default="engine,rend,next", help="comma separated: " + ",".join(paths))
+    parser.add_argument("--seconds", type=float, default=1.0, help="seconds of audio to render per case")
+    parser.add_argument("--next-seconds", type=float, default=0.02,
+                        help="seconds of audio to render per case on the per sample path")
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--budget", type=float, default=None,
+                        help="the lowest real time factor the engine is allowed before this fails")
+    parser.add_argument("--dtype", default="float64", choices=("float64", "float32"),
+                        help="what the engine renders in")
+    parser.add_argument("--effects", default="",
+                        help="comma separated effects to put on the engine: " + ",".join(effect_types))
+    parser.add_argument("--control-interval", type=int, default=1,
+                        help="frames between the engine's LFO and envelope values (1 runs them every frame)")
+    parser.add_argument("--fm", default=None, choices=sorted(presets),
+                        help="plays the engine's voices as this FM preset instead of the wave shapes")
+    parser.add_argument("--unison", type=int, default=1, help="detuned copies of every note the engine plays")
+    parser.add_argument("--channels", type=int, default=1, choices=(1, 2), help="the engine's output channels")
+    parser.add_argument("--startup-modules", default="Engine",
+                        help="comma separated modules to time importing in a fresh interpreter")
+    parser.add_argument("--startup-budget", type=float, default=None,
+                        help="the most milliseconds importing each of them is allowed before this fails")
+    parser.add_argument("--output", default=None, help="where to write the json (default: stdout)")
+    args = parser.parse_args()
+
+    report = run(voice_counts=args.voices, block_sizes=args.block_sizes, wave_shapes=args.shapes,
+                 path_names=args.paths.split(","), seconds=args.seconds, next_seconds=args.next_seconds,
+                 sample_rate=args.sample_rate, budget=args.budget, dtype=args.dtype,
+                 effects=[name for name in args.effects.split(",") if name], control_interval=args.control_interval,
+                 operators=args.fm, unison=args.unison, channels=args.channels,
+                 startup_modules=[name for name in args.startup_modules.split(",") if name],
+                 startup_budget=args.startup_budget)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+        for result in report["results"]:
+            print("{path:>6} {voices:>3} voices {wave_shape:>8} mod={modulation:d} adsr={adsr:d} "
+                  "block={block_size:>4}: {real_time_factor:8.1f}x".format(**result))
+            for cost in result.get("effects", []):
+                print("{:>40}: {:.3f}ms a block ({:.1%} of the deadline)".format(cost["effect"], cost["mean_ms"],
+                                                                              cost["deadline_share"]))
+        for result in report["startup"]:
+            print("import {module}: {import_ms:.1f}ms".format(**result)
+                  + (", loaded " + ", ".join(result["frontends_loaded"]) if result["frontends_loaded"] else ""))
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if not report["passed"]:
+        if not all(result.get("passed", True) for result in report["results"]):
+            print("real time factor under the budget of {}x".format(args.budget), file=sys.stderr)
+        if not all(result.get("passed", True) for result in report["startup"]):
+            print("importing took over the budget of {}ms, or loaded a front end".format(args.startup_budget),
+                  file=sys.stderr)
+        sys.exit(1)
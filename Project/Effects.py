@@ -0,0 +1,354 @@
+# effects on the mixed sound, between the voices and the clip in get_samples. every effect works on a whole block in
+# place and keeps whatever it needs (filter state, delay lines) from one block to the next, and an EffectsChain runs
+# them in order and times each one, so their cost can be weighed up against the number of voices.
+#
+# nothing here allocates once it's running: the delay lines and scratch space are all made up front.
+#
+# with more than one channel a block is (frames, channels), and every effect keeps its state for each channel
+# separately (but with the same settings), so the channels go through in one go.
+
+import math
+import time
+
+import numpy as np
+
+
+# a delay line: a preallocated circular buffer that blocks are written into and read back out of later.
+class _DelayLine:
+    def __init__(self, length, dtype=np.float64, channels=1):
+        self.buffer = np.zeros(length if channels == 1 else (length, channels), dtype=dtype)
+        # where the next sample gets written
+        self.pos = 0
+
+    # fills out with what was written delay samples before the next len(out). delay has to be at least len(out),
+    # otherwise some of it hasn't been written yet.
+    def read(self, delay, out):
+        length = len(self.buffer)
+        start = (self.pos - delay) % length
+        first = min(len(out), length - start)
+        out[:first] = self.buffer[start:start + first]
+        out[first:] = self.buffer[:len(out) - first]
+
+    def write(self, samples):
+        length = len(self.buffer)
+        first = min(len(samples), length - self.pos)
+        self.buffer[self.pos:self.pos + first] = samples[:first]
+        self.buffer[:len(samples) - first] = samples[first:]
+        self.pos = (self.pos + len(samples)) % length
+
+    def reset(self):
+        self.buffer.fill(0)
+        self.pos = 0
+
+
+class Effect:
+    name = "effect"
+
+    def __init__(self, sample_rate=44100, dtype=np.float64, channels=1):
+        self.sample_rate = sample_rate
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        # what it has cost so far, in seconds, filled in by the EffectsChain
+        self.blocks = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.last_time = 0.0
+
+    # processes block in place.
+    def process(self, block):
+        pass
+
+    # a buffer for n frames of every channel, in the effect's dtype unless another's given
+    def _zeros(self, n, dtype=None):
+        return np.zeros(n if self.channels == 1 else (n, self.channels), dtype=dtype or self.dtype)
+
+    # forgets anything left over from earlier blocks, like the tail of a delay.
+    def reset(self):
+        pass
+
+
+# the kinds of filter Biquad can be
+filter_kinds = ("lowpass", "highpass", "bandpass")
+
+
+# a two pole, two zero filter, with the coefficients from the audio eq cookbook.
+#
+# the recursion can't be vectorized as it is, so the block is worked out kernel samples at a time with a matrix
+# instead: the output of a chunk is its input times a triangular matrix of the filter's impulse response, plus the
+# response to whatever state the last chunk left (the last two inputs and outputs). both are worked out once whenever
+# the settings change, and after that a chunk is two matrix products.
+#
+# the filter itself always runs in float64, whatever dtype the blocks are: at a low cutoff or a high q the poles sit
+# right up against the unit circle, and float32 coefficients and state put it audibly off (by about 1e-3 at 20Hz with
+# a q of 10). a float32 block is copied into float64 scratch a chunk at a time, and the result copied back.
+class Biquad(Effect):
+    def __init__(self, kind="lowpass", cutoff=1000.0, q=0.7071, sample_rate=44100, dtype=np.float64, kernel=128,
+                 channels=1):
+        super().__init__(sample_rate=sample_rate, dtype=dtype, channels=channels)
+        if kind not in filter_kinds:
+            raise ValueError("kind must be one of " + ", ".join(filter_kinds))
+        self.kind = kind
+        self.name = kind
+        self.kernel = kernel
+        # the last two inputs and outputs: x[-1], x[-2], y[-1], y[-2]
+        self._state = self._zeros(4, np.float64)
+        self._in = self._zeros(kernel, np.float64)
+        self._out = self._zeros(kernel, np.float64)
+        self._tmp = self._zeros(kernel, np.float64)
+        self._cutoff = cutoff
+        self._q = q
+        self._design()
+
+    @property
+    def cutoff(self):
+        return self._cutoff
+
+    @cutoff.setter
+    def cutoff(self, value):
+        self._cutoff = value
+        self._design()
+
+    @property
+    def q(self):
+        return self._q
+
+    @q.setter
+    def q(self, value):
+        self._q = value
+        self._design()
+
+    def _design(self):
+        w0 = 2 * math.pi * min(self._cutoff, self.sample_rate * 0.49) / self.sample_rate
+        alpha = math.sin(w0) / (2 * self._q)
+        cos_w0 = math.cos(w0)
+        if self.kind == "lowpass":
+            b = ((1 - cos_w0) / 2, 1 - cos_w0, (1 - cos_w0) / 2)
+        elif self.kind == "highpass":
+            b = ((1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2)
+        else:
+            # constant 0dB peak gain
+            b = (alpha, 0.0, -alpha)
+        a0 = 1 + alpha
+        self.b = tuple(value / a0 for value in b)
+        self.a = (1.0, -2 * cos_w0 / a0, (1 - alpha) / a0)
+        self._build_kernel()
+
+    # runs the recursion once for an impulse and for each of the four state values on their own, which gives
+    # everything the matrices need.
+    def _build_kernel(self):
+        b0, b1, b2 = self.b
+        _, a1, a2 = self.a
+        n = self.kernel
+        responses = np.zeros((n, 5))
+        x1, x2, y1, y2 = np.eye(5)[1:]
+        impulse = np.eye(5)[0]
+        for i in range(n):
+            x = impulse if i == 0 else 0.0
+            y = b0 * x + b1 * x1 + b2 * x2 - a1 * y1 - a2 * y2
+            x2, x1 = x1, x
+            y2, y1 = y1, y
+            responses[i] = y
+        lags = np.arange(n)[:, None] - np.arange(n)[None, :]
+        self._impulse = np.where(lags >= 0, responses[np.maximum(lags, 0), 0], 0)
+        self._from_state = np.ascontiguousarray(responses[:, 1:])
+
+    def process(self, block):
+        state = self._state
+        for start in range(0, len(block), self.kernel):
+            chunk = block[start:start + self.kernel]
+            m = len(chunk)
+            x = chunk
+            if chunk.dtype != np.float64:
+                x = self._in[:m]
+                np.copyto(x, chunk)
+            out = self._out[:m]
+            tmp = self._tmp[:m]
+            np.matmul(self._impulse[:m, :m], x, out=out)
+            np.matmul(self._from_state[:m], state, out=tmp)
+            out += tmp
+            # the new state, before x gets written over
+            if m >= 2:
+                state[1] = x[m - 2]
+            else:
+                state[1] = state[0]
+            state[0] = x[m - 1]
+            state[3] = out[m - 2] if m >= 2 else state[2]
+            state[2] = out[m - 1]
+            np.copyto(chunk, out, casting="same_kind")
+
+    def reset(self):
+        self._state.fill(0)
+
+
+# an echo: the delayed sound is mixed in with the dry sound, and fed back into the delay so it repeats and dies away.
+class FeedbackDelay(Effect):
+    name = "delay"
+
+    def __init__(self, delay=0.3, feedback=0.4, mix=0.3, max_delay=2.0, sample_rate=44100, dtype=np.float64,
+                 channels=1):
+        super().__init__(sample_rate=sample_rate, dtype=dtype, channels=channels)
+        self.feedback = feedback
+        self.mix = mix
+        self._line = _DelayLine(int(max_delay * sample_rate) + 1, dtype=self.dtype, channels=channels)
+        self._delayed = self._zeros(0)
+        self._feed = self._zeros(0)
+        self.delay = delay
+
+    # the delay in seconds
+    @property
+    def delay(self):
+        return self._delay / self.sample_rate
+
+    @delay.setter
+    def delay(self, seconds):
+        self._delay = min(max(int(round(seconds * self.sample_rate)), 1), len(self._line.buffer) - 1)
+
+    def process(self, block):
+        n = len(block)
+        if len(self._delayed) < n:
+            self._delayed = self._zeros(n)
+            self._feed = self._zeros(n)
+        # a delay shorter than the block feeds back into the same block, so it goes a delay's worth at a time.
+        chunk = min(self._delay, n)
+        for start in range(0, n, chunk):
+            x = block[start:start + chunk]
+            delayed = self._delayed[:len(x)]
+            feed = self._feed[:len(x)]
+            self._line.read(self._delay, delayed)
+            np.multiply(delayed, self.feedback, out=feed)
+            feed += x
+            self._line.write(feed)
+            delayed *= self.mix
+            x += delayed
+
+    def reset(self):
+        self._line.reset()
+
+
+# a small schroeder reverb: four feedback combs in parallel, then two allpasses in series to smear the echoes out.
+# the delay lengths are freeverb's, which are spaced so the combs don't ring on the same notes.
+class Reverb(Effect):
+    name = "reverb"
+    comb_delays = (1116, 1188, 1277, 1356)
+    allpass_delays = (556, 441)
+
+    # room is how long it rings for (the combs' feedback), and mix how much of it is heard.
+    def __init__(self, room=0.84, mix=0.25, allpass_gain=0.5, sample_rate=44100, dtype=np.float64, channels=1):
+        super().__init__(sample_rate=sample_rate, dtype=dtype, channels=channels)
+        self.room = room
+        self.mix = mix
+        self.allpass_gain = allpass_gain
+        scale = sample_rate / 44100
+        self._combs = [(int(delay * scale), _DelayLine(int(delay * scale) + 1, dtype=self.dtype, channels=channels))
+                       for delay in self.comb_delays]
+        self._allpasses = [(int(delay * scale), _DelayLine(int(delay * scale) + 1, dtype=self.dtype,
+                                                           channels=channels))
+                           for delay in self.allpass_delays]
+        self._wet = self._zeros(0)
+        self._delayed = self._zeros(0)
+        self._feed = self._zeros(0)
+
+    def _comb(self, delay, line, x, wet):
+        for start in range(0, len(x), delay):
+            chunk = x[start:start + delay]
+            delayed = self._delayed[:len(chunk)]
+            feed = self._feed[:len(chunk)]
+            line.read(delay, delayed)
+            wet[start:start + delay] += delayed
+            np.multiply(delayed, self.room, out=feed)
+            feed += chunk
+            line.write(feed)
+
+    # v[n] = x[n] + g v[n - delay], y[n] = v[n - delay] - g v[n], in place on x.
+    def _allpass(self, delay, line, x):
+        gain = self.allpass_gain
+        for start in range(0, len(x), delay):
+            chunk = x[start:start + delay]
+            delayed = self._delayed[:len(chunk)]
+            feed = self._feed[:len(chunk)]
+            line.read(delay, delayed)
+            np.multiply(delayed, gain, out=feed)
+            feed += chunk
+            line.write(feed)
+            feed *= -gain
+            np.add(delayed, feed, out=chunk)
+
+    def process(self, block):
+        n = len(block)
+        if len(self._wet) < n:
+            self._wet = self._zeros(n)
+            self._delayed = self._zeros(n)
+            self._feed = self._zeros(n)
+        wet = self._wet[:n]
+        wet.fill(0)
+        for delay, line in self._combs:
+            self._comb(delay, line, block, wet)
+        wet *= 1 / len(self._combs)
+        for delay, line in self._allpasses:
+            self._allpass(delay, line, wet)
+        block *= 1 - self.mix
+        wet *= self.mix
+        block += wet
+
+    def reset(self):
+        for _, line in self._combs + self._allpasses:
+            line.reset()
+
+
+# the effects by name, for setting a chain up from a config (see EffectsChain.from_config)
+effect_types = {
+    "lowpass": lambda **kwargs: Biquad("lowpass", **kwargs),
+    "highpass": lambda **kwargs: Biquad("highpass", **kwargs),
+    "bandpass": lambda **kwargs: Biquad("bandpass", **kwargs),
+    "delay": FeedbackDelay,
+    "reverb": Reverb,
+}
+
+
+class EffectsChain:
+    def __init__(self, effects=None):
+        self.effects = list(effects) if effects is not None else []
+
+    # config is a list of (name, settings) from effect_types, like [("lowpass", {"cutoff": 2000}), ("reverb", {})].
+    @classmethod
+    def from_config(cls, config, sample_rate=44100, dtype=np.float64, channels=1):
+        return cls([effect_types[name](sample_rate=sample_rate, dtype=dtype, channels=channels, **settings)
+                    for name, settings in config])
+
+    def __len__(self):
+        return len(self.effects)
+
+    def append(self, effect):
+        self.effects.append(effect)
+
+    # runs block through every effect in place, timing each one.
+    def process(self, block):
+        for effect in self.effects:
+            start = time.perf_counter()
+            effect.process(block)
+            elapsed = time.perf_counter() - start
+            effect.blocks += 1
+            effect.total_time += elapsed
+            effect.last_time = elapsed
+            if elapsed > effect.max_time:
+                effect.max_time = elapsed
+        return block
+
+    def reset(self):
+        for effect in self.effects:
+            effect.reset()
+
+    # what each effect has cost per block, in milliseconds, and as a share of the time a block_size block lasts.
+    def costs(self, block_size=256, sample_rate=44100):
+        deadline = block_size / sample_rate
+        report = []
+        for effect in self.effects:
+            mean = effect.total_time / effect.blocks if effect.blocks else 0.0
+            report.append({
+                "effect": effect.name,
+                "blocks": effect.blocks,
+                "mean_ms": mean * 1000,
+                "max_ms": effect.max_time * 1000,
+                "deadline_share": mean / deadline,
+            })
+        return report
@@ -0,0 +1,300 @@
+import numpy as np
+
+from .Effects import EffectsChain
+from .FM import FMVoiceBank
+from .Generators import Interpolator, Oscillator, ModulationBus, control_points
+from .Tuning import Tuning
+from .Voices import VoiceBank
+
+# the default frequency of the LFOs
+default_LFO = 1
+
+
+# everything that makes the sound, without any of the audio output, keyboard or gui. the Synthesizer in main plays
+# it live, and Offline renders it straight to a file.
+class SynthEngine:
+    # with processes, the voices are rendered by that many worker processes (see Parallel) a block_size block behind.
+    # notes are MIDI note numbers, played in tuning (standard 440Hz equal temperament by default).
+    # dtype is what the blocks are rendered in. every buffer is made up front for block_size frames (and only made
+    # again if a bigger block is asked for), so rendering a block doesn't allocate anything.
+    # effects is an Effects.EffectsChain for the mixed sound, or a config for one (see EffectsChain.from_config).
+    # control_interval runs the LFOs and envelopes at a control rate, a value every that many frames (1 is every
+    # frame). the modulation is worked out on those and only drawn in to every frame where it's applied.
+    # operators makes every voice an FM graph instead of a wave shape: a preset from FM.presets, or a list of operators
+    # or their settings (see FM.operators_from_config).
+    # unison plays that many detuned copies of every note, detune cents apart at the most and spread across the stereo
+    # field (see Voices.VoiceBank). with channels=2 the blocks are stereo, (frames, 2), and get_samples interleaves
+    # them.
+    def __init__(self, sample_rate=44100, max_voices=32, steal_policy="released", lfos=None, amp_lfos=None,
+                 pitch_lfos=None, processes=0, block_size=256, dtype=np.float64, tuning=None, effects=None,
+                 control_interval=1, operators=None, unison=1, detune=15.0, spread=1.0, channels=1):
+        self.sample_rate = sample_rate
+        self.dtype = np.dtype(dtype)
+        self.control_interval = control_interval
+        self.channels = channels
+        if tuning is None:
+            tuning = Tuning.equal(sample_rate=sample_rate)
+        voice_options = dict(max_voices=max_voices, sample_rate=sample_rate, steal_policy=steal_policy, dtype=dtype,
+                             tuning=tuning, control_interval=control_interval, unison=unison, detune=detune,
+                             spread=spread, channels=channels)
+        if processes:
+            from .Parallel import ParallelVoices
+            self.voices = ParallelVoices(processes=processes, block_size=block_size, operators=operators,
+                                         **voice_options)
+        elif operators is not None:
+            self.voices = FMVoiceBank(operators=operators, **voice_options)
+        else:
+            self.voices = VoiceBank(**voice_options)
+        # the LFOs are shared by every voice. amp_lfos and pitch_lfos are the indexes of the ones that are active.
+        if lfos is None:
+            lfos = [Oscillator(freq=default_LFO, sample_rate=sample_rate) for _ in range(3)]
+        self.lfos = lfos
+        # every LFO is rendered once per block here, whatever it's routed to.
+        self.mod_bus = ModulationBus(lfos, dtype=dtype, interval=control_interval)
+        self.amp_lfos = amp_lfos if amp_lfos is not None else []
+        self.pitch_lfos = pitch_lfos if pitch_lfos is not None else []
+
+        self.wave_shape = 0  # default waveshape of sine.
+        # the total volume basically
+        self.amp = 0
+        # how far (in octaves) the pitch LFOs bend the notes
+        self.freq_scale = 1
+        # the envelope new notes get, in seconds
+        self.attack = 0.05
+        self.decay = 0.2
+        self.sustain = 0.7
+        self.release = 0.3
+        if effects is None:
+            effects = EffectsChain()
+        elif not isinstance(effects, EffectsChain):
+            effects = EffectsChain.from_config(effects, sample_rate=sample_rate, dtype=dtype, channels=channels)
+        self.effects = effects
+        # a Stats.RenderStats, when the render loop is being timed
+        self.stats = None
+        # a Scope.ScopeTap every rendered block is published to, when something's showing it
+        self.scope = None
+        # a Params.ParamStore the settings come from (a snapshot of it every block), when they're being changed from
+        # another thread
+        self.params = None
+        # the amp and pitch LFO depth the last block ended on. when they change, the next block glides from there
+        # instead of jumping, which would click (or buzz, while a slider's being dragged).
+        self._amp_from = None
+        self._scale_from = None
+        self._block_size = 0
+        self.prepare(block_size)
+
+    # makes the buffers for blocks of up to block_size frames, if they aren't that big already.
+    def prepare(self, block_size):
+        if block_size <= self._block_size:
+            return
+        self._amp_mod = np.zeros(block_size, dtype=self.dtype)
+        self._freq_mod = np.zeros(block_size, dtype=self.dtype)
+        # the modulation at the control rate, before it's drawn in (the same buffers when that's every frame)
+        interval = self.control_interval
+        if interval > 1:
+            points = control_points(block_size, interval)
+            self._amp_points = np.zeros(points, dtype=self.dtype)
+            self._freq_points = np.zeros(points, dtype=self.dtype)
+            self._interpolator = Interpolator(interval, dtype=self.dtype)
+        else:
+            self._amp_points = self._amp_mod
+            self._freq_points = self._freq_mod
+        channels = self.channels
+        self._mix = np.zeros(block_size if channels == 1 else (block_size, channels), dtype=self.dtype)
+        self._int16 = np.zeros(block_size * channels, dtype=np.int16)
+        # 1, 2, 3... for the glides, which are as long as a block or its control points (which can be one more)
+        self._counts = np.arange(1, block_size + 2, dtype=self.dtype)
+        self._glide = np.zeros(block_size + 1, dtype=self.dtype)
+        if hasattr(self.voices, "prepare"):
+            self.voices.prepare(block_size)
+        self._block_size = block_size
+
+    @property
+    def tuning(self):
+        return self.voices.tuning
+
+    # tuning can be a Tuning, the path of a Scala .scl file, or a reference pitch for A4 in equal temperament.
+    def set_tuning(self, tuning):
+        if isinstance(tuning, str):
+            tuning = Tuning.from_scala(tuning, sample_rate=self.sample_rate)
+        elif not isinstance(tuning, Tuning):
+            tuning = Tuning.equal(reference=float(tuning), sample_rate=self.sample_rate)
+        self.voices.set_tuning(tuning)
+
+    # starts a note (a MIDI note number). the envelope defaults to the engine's.
+    def note_on(self, key, note, amp=0.2, attack=None, decay=None, sustain=None, release=None):
+        self.voices.note_on(key, note,
+                            amp=amp,
+                            wave_shape=self.wave_shape,
+                            attack=self.attack if attack is None else attack,
+                            decay=self.decay if decay is None else decay,
+                            sustain=self.sustain if sustain is None else sustain,
+                            release=self.release if release is None else release)
+
+    def note_off(self, key, delay=0):
+        self.voices.note_off(key, delay)
+
+    def change_shape(self, shape_index):
+        self.voices.change_wave_shape(shape_index)
+        self.wave_shape = shape_index
+
+    def update_pitch(self, factor):
+        self.freq_scale = factor
+
+    # stops the worker processes, if there are any.
+    def close(self):
+        if hasattr(self.voices, "close"):
+            self.voices.close()
+
+    def enable_stats(self, stats):
+        self.stats = stats
+        self.voices.stats = stats
+
+    def enable_scope(self, scope):
+        self.scope = scope
+
+    # the parameters set_param takes, with the values they have now. a Params.ParamStore made from these can be given
+    # to use_params.
+    def param_values(self):
+        return {"amp": self.amp, "pitch": self.freq_scale, "wave_shape": self.wave_shape, "attack": self.attack,
+                "decay": self.decay, "sustain": self.sustain, "release": self.release,
+                "amp_lfos": tuple(self.amp_lfos), "pitch_lfos": tuple(self.pitch_lfos),
+                "lfo_freqs": tuple(lfo.freq for lfo in self.lfos)}
+
+    # takes the parameters from store from now on, a snapshot of them at the start of every block. it's how the gui
+    # changes them without touching anything the render thread is using.
+    def use_params(self, store):
+        self.params = store
+
+    # sets a parameter by name, the same way the gui would.
+    def set_param(self, name, value):
+        if name == "wave_shape":
+            self.change_shape(value)
+        elif name == "pitch":
+            self.update_pitch(value)
+        elif name == "tuning":
+            self.set_tuning(value)
+        elif name in ("amp_lfos", "pitch_lfos"):
+            # copied into the engine's own lists, since what comes in from the gui's ParamStore is a tuple
+            getattr(self, name)[:] = value
+        elif name == "lfo_freqs":
+            for lfo, freq in zip(self.lfos, value):
+                lfo.freq = freq
+        elif name in ("amp", "attack", "decay", "sustain", "release"):
+            setattr(self, name, value)
+        else:
+            raise ValueError("unknown parameter " + repr(name))
+
+    # applies an event from an EventQueue (or a Midi.MidiFilePlayer). for a param event the key is the parameter's
+    # name and args is the value.
+    def apply_event(self, kind, key, args=()):
+        if kind == "note_on":
+            self.note_on(key, *args)
+        elif kind == "note_off":
+            self.note_off(key, *args)
+        elif kind == "param":
+            self.set_param(key, *args)
+        else:
+            raise ValueError("unknown event " + repr(kind))
+
+    # renders a block with events (frame offset, kind, key, args) applied on their exact frames, by splitting the block
+    # up wherever one happens.
+    def _render_events(self, num_frames, amp_scale, events, out):
+        frame = 0
+        for offset, kind, key, args in sorted(events, key=lambda event: event[0]):
+            if offset > frame:
+                self._render_voices(offset - frame, amp_scale, out[frame:offset])
+                frame = offset
+            self.apply_event(kind, key, args)
+        if frame < num_frames:
+            self._render_voices(num_frames - frame, amp_scale, out[frame:])
+        return out
+
+    # renders and mixes the next num_frames frames through the effects, before clipping, into out if it's given.
+    # otherwise the block that comes back is the engine's own buffer, which the next render writes over.
+    def render(self, num_frames, amp_scale=0.2, events=None, out=None):
+        self.prepare(num_frames)
+        if self.params is not None:
+            for name, value in self.params.take():
+                self.set_param(name, value)
+        if out is None:
+            out = self._mix[:num_frames]
+        if events:
+            self._render_events(num_frames, amp_scale, events, out)
+        else:
+            self._render_voices(num_frames, amp_scale, out)
+        # the effects go over the whole block at once, wherever the events split it.
+        if self.effects.effects:
+            self.effects.process(out)
+            if self.stats is not None:
+                self.stats.mark("effects")
+        if self.scope is not None:
+            self.scope.publish(out)
+        return out
+
+    def _render_voices(self, num_frames, amp_scale, out):
+        # the LFOs are shared by every voice, so they only need rendering once per block. at a control rate they come
+        # back as points, and the modulation is drawn in to every frame once it's been worked out on those.
+        bus = self.mod_bus
+        bus.advance(num_frames)
+        interval = self.control_interval
+        size = control_points(num_frames, interval)
+        amp_mod = None
+        for lfo_index in self.amp_lfos:
+            lfo_points = bus.points(lfo_index)
+            if amp_mod is None:
+                amp_mod = lfo_points
+            else:
+                amp_mod = np.multiply(amp_mod, lfo_points, out=self._amp_points[:size])
+        freq_mod = None
+        if self.pitch_lfos:
+            freq_mod = self._freq_points[:size]
+            freq_mod.fill(0)
+            for lfo_index in self.pitch_lfos:
+                freq_mod += bus.points(lfo_index)
+            freq_mod *= self._glide_to("_scale_from", self.freq_scale, size)
+            np.exp2(freq_mod, out=freq_mod)
+        else:
+            # the depth isn't heard without a pitch LFO, so it keeps up with any change to it rather than gliding
+            # from wherever it was when they were turned off
+            self._scale_from = self.freq_scale
+        if interval > 1:
+            if amp_mod is not None:
+                amp_mod = self._interpolator.into(amp_mod, self._amp_mod[:num_frames])
+            if freq_mod is not None:
+                freq_mod = self._interpolator.into(freq_mod, self._freq_mod[:num_frames])
+        if self.stats is not None:
+            self.stats.mark("modulation")
+        # renders every voice and sums them up, then reduces the volume
+        self.voices.render(num_frames, amp_mod=amp_mod, freq_mod=freq_mod, out=out)
+        amp = self._glide_to("_amp_from", self.amp * amp_scale, num_frames)
+        if np.ndim(amp) and out.ndim > 1:
+            amp = amp[:, None]
+        out *= amp
+        return out
+
+    # the value to scale size frames (or points) by, for a parameter that was last at getattr(self, last): just value if
+    # it hasn't changed, otherwise a straight line from where it was to value, one step every frame.
+    def _glide_to(self, last, value, size):
+        start = getattr(self, last)
+        setattr(self, last, value)
+        if start is None or start == value:
+            return value
+        glide = self._glide[:size]
+        np.multiply(self._counts[:size], (value - start) / size, out=glide)
+        glide += start
+        return glide
+
+    # renders the next block as int16 (interleaved, in stereo). it's converted straight into out (say, the part of the
+    # output ring it's going to) if that's given, otherwise into a buffer that the next call reuses.
+    def get_samples(self, num_samples=256, amp_scale=0.2, max_amp=0.8, events=None, out=None):
+        samples = self.render(num_samples, amp_scale, events)
+        # clips the sound so that it doesn't burst your eardrums
+        np.clip(samples, -max_amp, max_amp, out=samples)
+        samples *= 32767
+        if out is None:
+            out = self._int16[:num_samples * self.channels]
+        np.copyto(out.reshape(samples.shape), samples, casting="unsafe")
+        if self.stats is not None:
+            self.stats.mark("convert")
+        return out
@@ -0,0 +1,43 @@
+import collections
+import time
+
+
+# note events on their way from the keyboard thread to the render thread. the keyboard thread pushes them with the
+# time they happened, and the render thread takes them all off once per block and works out which frame of the block
+# each one belongs on. that way the keyboard thread never touches the voices, and notes keep the timing they were
+# played with instead of all landing at the start of a block.
+class EventQueue:
+    def __init__(self, max_events=256):
+        # deque's append and popleft are atomic, so one thread can push while another drains.
+        self._events = collections.deque()
+        self.max_events = max_events
+        # events thrown away because the queue was full
+        self.dropped = 0
+        self._last_drain = time.perf_counter()
+
+    def __len__(self):
+        return len(self._events)
+
+    # adds an event. kind is "note_on", "note_off" or "param", and args are passed on after key (see
+    # SynthEngine.apply_event).
+    def push(self, kind, key, *args, timestamp=None):
+        if len(self._events) >= self.max_events:
+            self.dropped += 1
+            return False
+        if timestamp is None:
+            timestamp = time.perf_counter()
+        self._events.append((timestamp, kind, key, args))
+        return True
+
+    # takes every event off the queue, as (frame offset, kind, key, args) for a block of num_frames. the offset is how
+    # far after the last drain the event came in, so everything plays exactly one block late but keeps its spacing.
+    def drain(self, num_frames, sample_rate):
+        now = time.perf_counter()
+        since = self._last_drain
+        self._last_drain = now
+        events = []
+        while self._events:
+            timestamp, kind, key, args = self._events.popleft()
+            offset = int((timestamp - since) * sample_rate)
+            events.append((min(max(offset, 0), num_frames - 1), kind, key, args))
+        return events
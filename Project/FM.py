@@ -0,0 +1,239 @@
+# frequency modulation (really phase modulation, like most "FM" synths): every voice is a small graph of sine
+# operators, each running at its own ratio of the note's frequency with its own envelope. an operator's output is
+# added straight onto the phase of the operators it modulates, scaled by its index (how many radians it swings them),
+# and the operators that don't modulate anything (the carriers) are what's heard.
+#
+# the graph is rendered for every voice at once: each operator is a (voices, frames) block, worked out in an order
+# where a modulator's whole block is ready before the operators it feeds. there's no feedback (an operator modulating
+# itself, or anything that modulates it), since that can only be done a sample at a time.
+#
+# FMVoiceBank is a VoiceBank that plays the graph instead of a wave shape. the voice's own envelope still shapes how
+# loud the note is, so the engine's attack, decay, sustain and release work the same as before, and the operators'
+# envelopes shape the sound on top of that.
+
+import math
+
+import numpy as np
+
+from .Generators import ADSREnvelope, Oscillator, adsr_level
+from .Voices import VoiceBank, never
+
+
+class Operator(Oscillator):
+    __slots__ = ("ratio", "index", "level", "modulators", "envelope")
+
+    # ratio is its frequency as a multiple of the note's. index is how far (in radians) it swings the phase of the
+    # operators it modulates, and level is how loud it is as a carrier. modulators are the indexes of the operators
+    # that modulate it. the envelope lengths are in seconds, and without a release it holds its level, leaving the
+    # fade out to the voice's own release. on its own it plays like an Oscillator at freq times ratio.
+    def __init__(self, ratio=1.0, index=1.0, level=1.0, modulators=(), attack=0.0, decay=0.0, sustain=1.0,
+                 release=None, freq=440, sample_rate=44100):
+        super().__init__(freq=freq * ratio, sample_rate=sample_rate)
+        self.ratio = ratio
+        self.index = index
+        self.level = level
+        self.modulators = tuple(modulators)
+        self.envelope = ADSREnvelope(attack, decay, sustain, math.inf if release is None else release, sample_rate)
+
+    # the settings it was made with, which is all a worker process needs to make it again (see Parallel).
+    def config(self):
+        envelope = self.envelope
+        return {"ratio": self.ratio, "index": self.index, "level": self.level, "modulators": self.modulators,
+                "attack": envelope.attack_duration, "decay": envelope.decay_duration,
+                "sustain": envelope.sustain_level,
+                "release": None if envelope.release_duration == math.inf else envelope.release_duration}
+
+    # whether the envelope does nothing (it's straight to full and stays there)
+    @property
+    def flat(self):
+        envelope = self.envelope
+        return (envelope.attack_duration == 0 and envelope.decay_duration == 0 and envelope.sustain_level == 1
+                and envelope.release_duration == math.inf)
+
+
+# some patches to start from, as operator settings (see operators_from_config).
+presets = {
+    # two stacks: a soft body, and a high ratio tine that only rings at the start of the note
+    "electric_piano": [
+        {"ratio": 1, "level": 0.8, "modulators": (1,)},
+        {"ratio": 1, "index": 1.8, "decay": 1.5, "sustain": 0.15},
+        {"ratio": 1, "level": 0.4, "modulators": (3,)},
+        {"ratio": 14, "index": 1.2, "decay": 0.12, "sustain": 0},
+    ],
+    # an inharmonic ratio that dies away, leaving the plain sine
+    "bell": [
+        {"ratio": 1, "modulators": (1,)},
+        {"ratio": 3.5, "index": 4, "decay": 2.5, "sustain": 0},
+    ],
+    # a modulator that's itself modulated, for a buzzier attack
+    "bass": [
+        {"ratio": 1, "modulators": (1,)},
+        {"ratio": 1, "index": 2.5, "decay": 0.3, "sustain": 0.3, "modulators": (2,)},
+        {"ratio": 2, "index": 1.2, "decay": 0.1, "sustain": 0},
+    ],
+    # the brightness comes in with the note, so it swells like a brass section
+    "brass": [
+        {"ratio": 1, "modulators": (1,)},
+        {"ratio": 1, "index": 2.2, "attack": 0.08, "decay": 0.2, "sustain": 0.7, "release": 0.2},
+    ],
+}
+
+
+# the operators for a config: a preset's name, or a list of Operators or their settings as dicts.
+def operators_from_config(config, sample_rate=44100):
+    if isinstance(config, str):
+        if config not in presets:
+            raise ValueError("unknown FM preset {!r} (there's {})".format(config, ", ".join(presets)))
+        config = presets[config]
+    return [settings if isinstance(settings, Operator) else Operator(sample_rate=sample_rate, **settings)
+            for settings in config]
+
+
+# the order to render operators in, so every operator comes after the ones that modulate it.
+def render_order(operators):
+    order = []
+    # 1 while an operator's modulators are being visited, 2 once it's in the order
+    state = [0] * len(operators)
+
+    def visit(i):
+        if state[i] == 1:
+            raise ValueError("operator {} modulates itself (through its modulators), which isn't supported".format(i))
+        if state[i] == 2:
+            return
+        state[i] = 1
+        for modulator in operators[i].modulators:
+            if not 0 <= modulator < len(operators):
+                raise ValueError("operator {} is modulated by operator {}, which doesn't exist".format(i, modulator))
+            visit(modulator)
+        state[i] = 2
+        order.append(i)
+
+    for i in range(len(operators)):
+        visit(i)
+    return order
+
+
+# a VoiceBank that plays an FM graph of operators. carriers are the indexes of the operators that are heard, which are
+# the ones that don't modulate anything unless it's given. the voice's wave shape doesn't do anything here, and
+# neither does unison: the operators' phases are worked out from the voice's, which the copies don't have.
+class FMVoiceBank(VoiceBank):
+    def __init__(self, operators="electric_piano", carriers=None, sample_rate=44100, **kwargs):
+        if kwargs.get("unison", 1) > 1:
+            raise ValueError("FM voices can't be played in unison")
+        self.operators = operators_from_config(operators, sample_rate)
+        self.order = render_order(self.operators)
+        if carriers is None:
+            modulating = {modulator for operator in self.operators for modulator in operator.modulators}
+            carriers = [i for i in range(len(self.operators)) if i not in modulating]
+        self.carriers = tuple(carriers)
+        super().__init__(sample_rate=sample_rate, **kwargs)
+        # every operator's phase (carried on from block to block, since with a ratio that isn't whole it doesn't line
+        # up with the voice's) and the level its envelope releases from, per voice.
+        count = len(self.operators)
+        self.op_phase = np.zeros((count, self.max_voices))
+        self.op_release_val = np.zeros((count, self.max_voices))
+        self._arrays += [self.op_phase, self.op_release_val]
+        # each operator's envelope the way VoiceBank._envelope takes it, with the lengths in samples. the per voice
+        # values are filled in every block.
+        self._curves = []
+        for operator in self.operators:
+            envelope = operator.envelope
+            attack = envelope.attack_duration * sample_rate
+            decay = envelope.decay_duration * sample_rate
+            sustain = envelope.sustain_level
+            self._curves.append({
+                "attack": attack,
+                "attack_rate": 1 / attack if attack > 0 else 0,
+                "decay_end": attack + decay,
+                "decay_rate": (1 - sustain) / decay if decay > 0 else 0,
+                "sustain": sustain,
+                "release": envelope.release_duration * sample_rate,
+            })
+
+    def _allocate(self, block_size):
+        super()._allocate(block_size)
+        voices, dtype = self.max_voices, self.dtype
+        self._op_out = np.zeros((len(self.operators), voices * block_size), dtype=dtype)
+        self._op_env = np.zeros(voices * block_size, dtype=dtype)
+        self._advance = np.zeros(voices * block_size, dtype=dtype)
+        # an operator's phase, release level, release rate and release end in the render dtype, for the block
+        self._op_params = np.zeros((4, voices), dtype=dtype)
+        self._op_steps = np.zeros((2, voices))
+        # every operator is a sine, which is the same in every octave's table
+        self._sine = self.wavetables.offset(0, 0)
+
+    def note_on(self, key, note, amp=0.2, wave_shape=0, attack=0.05, decay=0.2, sustain=0.7, release=0.3):
+        i = super().note_on(key, note, amp, wave_shape, attack, decay, sustain, release)
+        if i is not None:
+            self.op_phase[:, i] = 0
+            self.op_release_val[:, i] = 0
+        return i
+
+    def note_off(self, key, delay=0):
+        i = super().note_off(key, delay)
+        if i is not None:
+            release_t = float(self.release_t[i])
+            for k, curve in enumerate(self._curves):
+                self.op_release_val[k, i] = adsr_level(release_t, curve["attack"], curve["decay_end"] - curve["attack"],
+                                                       curve["sustain"])
+        return i
+
+    # operator k's envelope for the block, the way _envelope takes it.
+    def _op_envelope(self, k, p, n):
+        curve = self._curves[k]
+        release = curve["release"]
+        phase, release_val, release_rate, release_end = self._op_params[:, :n]
+        p_op = dict(curve, t=p["t"])
+        if release == math.inf:
+            # it holds its level through the voice's release
+            p_op.update(release_t=never, release_val=0, release_rate=0, release_end=never)
+            return p_op
+        np.copyto(release_val, self.op_release_val[k, :n], casting="same_kind")
+        np.multiply(release_val, 1 / release if release > 0 else 0, out=release_rate)
+        np.add(p["release_t"][:, 0], release, out=release_end)
+        p_op.update(release_t=p["release_t"], release_val=release_val[:, None], release_rate=release_rate[:, None],
+                    release_end=release_end[:, None])
+        return p_op
+
+    def _oscillate(self, phases, freq_mod, p, tmp, column):
+        n, num_frames = phases.shape
+        # how far each voice's phase has moved since the start of the block. every operator follows it at its ratio.
+        advance = self._view(self._advance, n, num_frames)
+        np.copyto(column, p["phase"])
+        np.subtract(phases, column, out=advance)
+        index = self._view(self._index, n, num_frames)
+        samples = self._view(self._samples, n, num_frames)
+        op_phase = self._op_params[0, :n, None]
+        for k in self.order:
+            operator = self.operators[k]
+            out = self._view(self._op_out[k], n, num_frames)
+            np.multiply(advance, operator.ratio, out=out)
+            np.copyto(op_phase[:, 0], self.op_phase[k, :n], casting="same_kind")
+            np.copyto(column, op_phase)
+            out += column
+            # the modulators' blocks go straight onto the phase
+            for modulator in operator.modulators:
+                np.multiply(self._view(self._op_out[modulator], n, num_frames), self.operators[modulator].index,
+                            out=tmp)
+                out += tmp
+            self.wavetables.read_into(self._sine, out, out, tmp, index, samples)
+            if not operator.flat:
+                env = self._view(self._op_env, n, num_frames)
+                self._render_envelope(env, self._op_envelope(k, p, n), tmp, column)
+                out *= env
+
+        # the carriers are mixed into phases, which isn't needed any more
+        vals = phases
+        vals.fill(0)
+        for k in self.carriers:
+            np.multiply(self._view(self._op_out[k], n, num_frames), self.operators[k].level, out=tmp)
+            vals += tmp
+
+        # the operators' phases carry on from where this block ends
+        moved, step = self._op_steps[:, :n]
+        np.subtract(self._ends[:n], self.phase[:n], out=moved)
+        for k, operator in enumerate(self.operators):
+            np.multiply(moved, operator.ratio, out=step)
+            step += self.op_phase[k, :n]
+            np.remainder(step, 2 * np.pi, out=self.op_phase[k, :n])
+        return vals
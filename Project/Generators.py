@@ -2,12 +2,81 @@
 # and from https://python.plainenglish.io/build-your-own-python-synthesizer-part-2-66396f6dad81
 
 from abc import ABC, abstractmethod
-import itertools
+import math
+from types import MethodType
 import numpy as np
 
+from .Wavetables import get_wavetables
+
+
+# vectorized wave shapes. each one takes an array of phases in radians and returns values from -1 to 1.
+def sine_wave(phases):
+    return np.sin(phases)
+
+
+def square_wave(phases):
+    # the sine wave thresholded to -1 or 1, worked out from where the phase is in the cycle.
+    cycle = np.mod(phases, 2 * np.pi)
+    return np.where(cycle < np.pi, 1.0, -1.0)
+
+
+def saw_wave(phases):
+    div = phases / (2 * np.pi)
+    return 2 * (div - np.floor(0.5 + div))
+
+
+def triangle_wave(phases):
+    return (np.abs(saw_wave(phases)) - 0.5) * 2
+
+
+# in the same order as the wave shape buttons.
+wave_shapes = [sine_wave, square_wave, saw_wave, triangle_wave]
+
+
+# modulators and envelopes can run at a control rate: a value (a point) every interval frames instead of every frame,
+# with the frames in between drawn in as straight lines only where they're used. the points of a block start on its
+# first frame and go one past its end, so a block of num_frames needs this many (an interval of 1 is just every frame).
+def control_points(num_frames, interval):
+    if interval <= 1:
+        return num_frames
+    return -(-num_frames // interval) + 1
+
+
+# draws the straight lines between points (a point every interval frames along the last axis, as control_points gives)
+# in to every frame. rather than working out the lines piece by piece, a chunk of frames at a time is one matrix
+# product with the weights each frame takes from the points either side of it, which are only worked out once.
+class Interpolator:
+    def __init__(self, interval, dtype=np.float64, chunk=256):
+        self.interval = interval
+        # a whole number of intervals, so every chunk starts on a point
+        self.chunk = interval * max(1, chunk // interval)
+        frames = np.arange(self.chunk)
+        before = frames // interval
+        after = (frames % interval) / interval
+        self._weights = np.zeros((control_points(self.chunk, interval), self.chunk), dtype=dtype)
+        self._weights[before, frames] = 1 - after
+        self._weights[before + 1, frames] += after
+
+    # fills out (..., frames) from points (..., control_points(frames, interval)).
+    def into(self, points, out):
+        interval, chunk = self.interval, self.chunk
+        num_frames = out.shape[-1]
+        for start in range(0, num_frames, chunk):
+            frames = min(chunk, num_frames - start)
+            first = start // interval
+            size = control_points(frames, interval)
+            np.matmul(points[..., first:first + size], self._weights[:size, :frames], out=out[..., start:start + frames])
+        return out
+
 
 # a simple oscillator that can change wave shape while a note is playing
+#
+# the oscillator classes (and the modulated oscillator and envelope) have __slots__, so they're small, quick to make and
+# can't grow new attributes. a voice can be reset() and used again for another note instead of being made from scratch
+# (see VoicePool).
 class VariableOscillator(ABC):
+    __slots__ = ("_freq", "_amp", "_phase", "_wave_range", "_wave_shape", "_f", "_a", "_p")
+
     def __init__(self, freq=440, phase=0, amp=1, wave_range=(-1, 1), wave_shape=0):
         # the initial conditions, so that it remembers what it started at
         self._freq = freq
@@ -96,14 +165,204 @@ class VariableOscillator(ABC):
     def sine_gen(self, num_frames):
         pass
 
+    # renders the next num_frames frames as an array.
+    def rend(self, num_frames):
+        pass
+
+    # renders one frame for every frequency in freqs, so the pitch can change within a block. offsets (in radians, one
+    # per frame) are added to the phase, for phase modulation.
+    def rend_freqs(self, freqs, offsets=None):
+        pass
+
+    # rend() written into out, for rendering into a buffer that's reused every block.
+    def rend_into(self, out):
+        out[:] = self.rend(len(out))
+        return out
+
+    # renders the next num_frames frames at a control rate, into out: the points every interval frames from the first
+    # one (see control_points). this one still renders every frame and picks the points out, so oscillators that can
+    # should do better.
+    def rend_points(self, out, interval, num_frames):
+        vals = self.rend(num_frames)
+        points = vals[::interval]
+        out[:len(points)] = points
+        # the point past the end is held from the last frame
+        out[len(points):] = vals[-1]
+        return out
+
+# code modified from https://python.plainenglish.io/making-a-synth-with-python-oscillators-2cb8e68e9c3b
+class Oscillator(VariableOscillator):
+    __slots__ = ("_sample_rate", "_wavetables", "_scratch", "_step", "_period", "_i", "_iterators", "_blocks",
+                 "iterate", "render")
+
+    def __init__(self, freq=440, phase=0, amp=1, wave_range=(-1, 1), wave_shape=0, sample_rate=44100):
+        self._sample_rate = sample_rate
+        # the band limited tables it reads from, shared by every oscillator at this sample rate.
+        self._wavetables = get_wavetables(sample_rate)
+        # the arrays rend_into works in, made the first time it's used
+        self._scratch = None
+        # every wave shape's functions bound to this oscillator, once, so changing shape is just picking two of them
+        self._iterators = tuple(MethodType(func, self) for func in self.wave_shape_to_func)
+        self._blocks = tuple(MethodType(func, self) for func in self.wave_shape_to_block)
+        super().__init__(freq=freq, phase=phase, amp=amp, wave_range=wave_range, wave_shape=wave_shape)
+
+    def _post_freq_set(self):
+        self._step = (2 * math.pi * self._f) / self._sample_rate
+        self._period = self._sample_rate / self._f
+
+    def _post_phase_set(self):
+        self._p = (self._p / 360) * 2 * math.pi
+
+    # starts the oscillator again from the beginning of its cycle, as if it had just been made with these.
+    def reset(self, freq=None, amp=None, phase=None, wave_shape=None):
+        if freq is not None:
+            self._freq = freq
+        if amp is not None:
+            self._amp = amp
+        if phase is not None:
+            self._phase = phase
+        self.freq = self._freq
+        self.phase = self._phase
+        self.amp = self._amp
+        self._i = 0
+        if wave_shape is not None and wave_shape != self._wave_shape:
+            self.change_wave_shape(wave_shape)
+
+    def _initialize_osc(self):
+        # _i is the phase in radians for every wave shape, so a note can switch shape without jumping.
+        self._i = 0
+        self.change_wave_shape(self._wave_shape)
+
+    def __next__(self):
+        return self.iterate()
+
+    # renders the next num_frames frames of whichever wave shape is selected.
+    def rend(self, num_frames):
+        return self.render(num_frames)
+
+    # renders a block where the frequency changes every frame. the phase is the running sum of each frame's step
+    # so the pitch bends smoothly from one block to the next without jumping. offsets move each frame's phase without
+    # moving the oscillator on, which is phase modulation.
+    def rend_freqs(self, freqs, offsets=None):
+        steps = freqs * (2 * math.pi / self._sample_rate)
+        phases = np.cumsum(steps)
+        end = phases[-1] if len(phases) else 0
+        # each frame uses the phase from before its own step.
+        phases -= steps
+        phases += self._i + self._p
+        if offsets is not None:
+            phases += offsets
+        self._i = (self._i + end) % (2 * math.pi)
+        # the highest frequency in the block picks the table, so none of it aliases.
+        top = np.abs(freqs).max() if len(freqs) else self._f
+        return self._wavetables.lookup(self._wave_shape, top, phases) * self._a
+
+    # renders the selected wave shape into out without allocating anything, once its scratch space is big enough.
+    # out can be float32.
+    def rend_into(self, out):
+        return self._rend_phases(out, self._step, len(out))
+
+    # the same, but only the points every interval frames (see control_points), so it costs a point rather than a
+    # frame each.
+    def rend_points(self, out, interval, num_frames):
+        return self._rend_phases(out, self._step * interval, num_frames)
+
+    # renders into out with the phase moving step from one value to the next, then moves the oscillator on num_frames
+    # frames.
+    def _rend_phases(self, out, step, num_frames):
+        size = len(out)
+        scratch = self._scratch
+        if scratch is None or len(scratch[0]) < size or scratch[0].dtype != out.dtype:
+            scratch = self._scratch = (np.arange(size, dtype=out.dtype), np.empty(size, dtype=out.dtype),
+                                       np.empty(size, dtype=np.intp),
+                                       np.empty(size, dtype=np.complex64 if out.dtype == np.float32 else complex))
+        ramp, whole, index, samples = scratch
+        np.multiply(ramp[:size], step, out=out)
+        out += self._i + self._p
+        self._i = (self._i + num_frames * self._step) % (2 * math.pi)
+        self._wavetables.read_into(self._wavetables.offset(self._wave_shape, self._f), out, out, whole[:size],
+                                   index[:size], samples[:size])
+        out *= self._a
+        return out
+
+    # the phases (in radians) of the next num_frames frames, carrying on from where the last block ended.
+    def _phases(self, num_frames):
+        phases = self._i + self._p + np.arange(num_frames) * self._step
+        # keep _i wrapped to one cycle so it doesn't lose precision on long notes.
+        self._i = (self._i + num_frames * self._step) % (2 * math.pi)
+        return phases
+
+    # generates a sine wave
+    def _sine_iterator(self):
+        val = math.sin(self._i + self._p)
+        self._i = self._i + self._step
+        return val * self._a
+
+    # generates a bunch of frames all at once.
+    def sine_gen(self, num_frames):
+        return self._wavetables.lookup(0, self._f, self._phases(num_frames)) * self._a
+
+    # generates a square wave
+    def _square_iterator(self):
+        val = math.sin(self._i + self._p)
+        self._i = self._i + self._step
+        # threshold the value to -1 or 1
+        if val < 0:
+            val = -1
+        else:
+            val = 1
+        return val * self._a
+
+    def square_gen(self, num_frames):
+        return self._wavetables.lookup(1, self._f, self._phases(num_frames)) * self._a
+
+    # generate a sawtooth wave
+    def _saw_iterator(self):
+        div = (self._i + self._p) / (2 * math.pi)
+        val = 2 * (div - math.floor(0.5 + div))
+        self._i = self._i + self._step
+        return val * self._a
+
+    def saw_gen(self, num_frames):
+        return self._wavetables.lookup(2, self._f, self._phases(num_frames)) * self._a
+
+    # generate a triangle wave
+    def _triangle_iterator(self):
+        div = (self._i + self._p) / (2 * math.pi)
+        val = 2 * (div - math.floor(0.5 + div))
+        val = (abs(val) - 0.5) * 2
+        self._i = self._i + self._step
+        return val * self._a
+
+    def triangle_gen(self, num_frames):
+        return self._wavetables.lookup(3, self._f, self._phases(num_frames)) * self._a
+
+    # the per sample function for each wave shape, and the vectorized versions, which render a whole block at once.
+    wave_shape_to_func = (_sine_iterator, _square_iterator, _saw_iterator, _triangle_iterator)
+    wave_shape_to_block = (sine_gen, square_gen, saw_gen, triangle_gen)
+
+    # whenever the wave shape is changed it changes the function that __next__ calls.
+    def change_wave_shape(self, new_wave_shape):
+        self._wave_shape = new_wave_shape
+        self.iterate = self._iterators[new_wave_shape]
+        self.render = self._blocks[new_wave_shape]
+
+
 # a class that will modulate the oscillator via the modulators inputted.
+#
+# phase_modulators are added up and swing the oscillator's phase by up to phase_scale radians, which is what an FM synth
+# really does (see FM for a whole graph of them, for every voice at once).
 class ModulatedOscillator:
-    def __init__(self, oscillator, amp_modulators=None, freq_modulators=None, freq_scale=0):
+    __slots__ = ("oscillator", "amp_mods", "freq_mods", "phase_mods", "freqScale", "phaseScale")
+
+    def __init__(self, oscillator, amp_modulators=None, freq_modulators=None, freq_scale=0, phase_modulators=None,
+                 phase_scale=1):
         self.oscillator = oscillator
-        self.amp_mods = amp_modulators  # a list of modulators
-        self.freq_mods = freq_modulators  # list
-        # self.phase_mods = phase_modulators  # list
+        self.amp_mods = amp_modulators if amp_modulators is not None else []  # a list of modulators
+        self.freq_mods = freq_modulators if freq_modulators is not None else []  # list
+        self.phase_mods = phase_modulators if phase_modulators is not None else []  # list
         self.freqScale = freq_scale
+        self.phaseScale = phase_scale
         # a list of all the modulators in one place
         # self.modulators = amp_modulators.append(freq_mods).append(phase_mods)
 
@@ -115,7 +374,7 @@ class ModulatedOscillator:
         # iterate through all the modulators if applicable
         [iter(amp_modulator) for amp_modulator in self.amp_mods]
         [iter(amp_modulator) for amp_modulator in self.freq_mods]
-        # [iter(amp_modulator) for amp_modulator in self.phase_mods]
+        [iter(amp_modulator) for amp_modulator in self.phase_mods]
         return self
 
     def _modulate(self):
@@ -134,22 +393,22 @@ class ModulatedOscillator:
             new_freq = freq_factor * self.oscillator.init_freq
             self.oscillator.freq = new_freq
 
-        # if self.phase_mods is not None:
-        #     phase_mod = np.prod([next(phase_mod) for phase_mod in self.phase_mods]) * 360
-        #     new_phase = self.oscillator.init_phase + phase_mod
-        #     self.oscillator.phase = new_phase
-        #     # TODO: Dont include phase?
-
-        #     if self._modulators_count == 3:
-        #         mod_val = mod_vals[2]
-        #     else:
-        #         mod_val = mod_vals[-1]
-        #     new_phase = self.phase_mod(self.oscillator.init_phase, mod_val)
-        #     self.oscillator.phase = new_phase
+        if self.phase_mods:
+            # the phase is set in degrees, from where the oscillator started
+            phase_mod = sum(next(phase_mod) for phase_mod in self.phase_mods) * self.phaseScale
+            self.oscillator.phase = self.oscillator.init_phase + math.degrees(phase_mod)
 
     def change_wave_shape(self, shape_index):
         self.oscillator.change_wave_shape(shape_index)
 
+    # starts the voice again for a new note: the oscillator from the start of its cycle with the new settings, and
+    # its envelopes from the start with the new lengths. shared modulators like LFOs carry on as they were.
+    def reset(self, freq=None, amp=None, wave_shape=None, attack=None, decay=None, sustain=None, release=None):
+        self.oscillator.reset(freq=freq, amp=amp, wave_shape=wave_shape)
+        for modulator in self.amp_mods:
+            if hasattr(modulator, "trigger_release"):
+                modulator.reset(attack, decay, sustain, release)
+
     def change_freq(self, factor):
         self.oscillator.freq = self.oscillator.init_freq * factor
 
@@ -161,13 +420,14 @@ class ModulatedOscillator:
     # def freqScale(self, value):
     #     self._freqScale = value
 
-    def trigger_release(self):
+    # delay is how many frames into the next render the release starts (see ADSREnvelope.trigger_release).
+    def trigger_release(self, delay=0):
         tr = "trigger_release"
         for modulator in self.amp_mods:  # only amp_mods since ADSR will do amplitude only.
             if hasattr(modulator, tr):
-                modulator.trigger_release()
+                modulator.trigger_release(delay)
         if hasattr(self.oscillator, tr):
-            self.oscillator.trigger_release()
+            self.oscillator.trigger_release(delay)
 
     @property
     def ended(self):
@@ -186,76 +446,342 @@ class ModulatedOscillator:
         return next(self.oscillator)
 
     # renders an array of the next num_frames frames. to replace __next__ but vectorized.
+    # every modulator is pulled for the whole block at once, rather than once per sample like _modulate.
     def rend(self, num_frames):
-        return self.oscillator.sine_gen(num_frames)
-
-
+        offsets = None
+        if self.phase_mods:
+            # the phase modulators' outputs go straight into the oscillator's phase
+            offsets = sum(phase_mod.rend(num_frames) for phase_mod in self.phase_mods) * self.phaseScale
+        if self.freq_mods:
+            # add up the pitch modulators (in octaves) and turn them into the frequency for every frame.
+            octaves = sum(freq_mod.rend(num_frames) for freq_mod in self.freq_mods) * self.freqScale
+            vals = self.oscillator.rend_freqs(self.oscillator.init_freq * np.exp2(octaves), offsets)
+        elif offsets is not None:
+            vals = self.oscillator.rend_freqs(np.full(num_frames, self.oscillator.freq), offsets)
+        else:
+            vals = self.oscillator.rend(num_frames)
+        # the amplitude of all the modulators multiplied for each frame.
+        for amp_mod in self.amp_mods:
+            vals *= amp_mod.rend(num_frames)
+        return vals
+
+
+
+# a fixed number of voices (ModulatedOscillators with their own Oscillator and, with envelopes, ADSREnvelope) made up
+# front. a note on resets a free voice rather than making a new one, and a voice that has finished goes back to be
+# used again, so playing doesn't make or throw away any objects. like the VoiceBank, the playing voices are kept packed
+# at the front of voices, and the oldest is taken over when they're all playing.
+#
+# it's how the object per voice paths are played (Benchmark's rend and next); the live synth and the engine use the
+# VoiceBank instead, which has no objects per voice to begin with.
+class VoicePool:
+    def __init__(self, size=32, sample_rate=44100, amp_modulators=(), freq_modulators=(), freq_scale=0,
+                 envelopes=True, control_interval=1):
+        self.voices = []
+        for _ in range(size):
+            amp_mods = list(amp_modulators)
+            if envelopes:
+                amp_mods.insert(0, ADSREnvelope(sample_rate=sample_rate, control_interval=control_interval))
+            self.voices.append(ModulatedOscillator(Oscillator(sample_rate=sample_rate), amp_modulators=amp_mods,
+                                                   freq_modulators=list(freq_modulators), freq_scale=freq_scale))
+        self.size = size
+        self.envelopes = envelopes
+        # how many voices are playing
+        self.count = 0
+        # whatever each voice was started with, and when, by slot
+        self.keys = [None] * size
+        self.released = [False] * size
+        self.started = [0] * size
+        # without envelopes, how many frames into the next render each released voice stops (None if it isn't)
+        self.stop_at = [None] * size
+        self._note_ons = 0
+        # what rend mixes into, made again only if a bigger block comes along
+        self._mix = np.zeros(0)
+
+    def __len__(self):
+        return self.count
+
+    # the slot of the voice playing key that hasn't been released, or -1.
+    def _held(self, key):
+        for i in range(self.count):
+            if self.keys[i] == key and not self.released[i]:
+                return i
+        return -1
+
+    def _oldest(self):
+        oldest = 0
+        for i in range(1, self.count):
+            if self.started[i] < self.started[oldest]:
+                oldest = i
+        return oldest
+
+    # starts a voice and hands it back. nothing happens (and None comes back) if key is already being held.
+    def note_on(self, key, freq, amp=0.2, wave_shape=0, attack=0.05, decay=0.2, sustain=0.7, release=0.3):
+        if self._held(key) >= 0:
+            return None
+        if self.count < self.size:
+            i = self.count
+            self.count += 1
+        else:
+            i = self._oldest()
+        voice = self.voices[i]
+        voice.reset(freq=freq, amp=amp, wave_shape=wave_shape, attack=attack, decay=decay, sustain=sustain,
+                    release=release)
+        self.keys[i] = key
+        self.released[i] = False
+        self.stop_at[i] = None
+        self.started[i] = self._note_ons
+        self._note_ons += 1
+        return voice
+
+    # releases the voice held by key, delay frames into the next render. without envelopes it just stops there, and
+    # is put back once that frame's been rendered.
+    def note_off(self, key, delay=0):
+        i = self._held(key)
+        if i < 0:
+            return
+        self.released[i] = True
+        if self.envelopes:
+            self.voices[i].trigger_release(delay)
+        elif delay > 0:
+            self.stop_at[i] = delay
+        else:
+            self._free(i)
+
+    # puts the voice in slot i back, moving the last playing voice into its place.
+    def _free(self, i):
+        last = self.count - 1
+        if i != last:
+            voices, keys, released, started = self.voices, self.keys, self.released, self.started
+            voices[i], voices[last] = voices[last], voices[i]
+            keys[i] = keys[last]
+            released[i] = released[last]
+            started[i] = started[last]
+            self.stop_at[i] = self.stop_at[last]
+        self.keys[last] = None
+        self.stop_at[last] = None
+        self.count = last
+
+    # puts back every voice whose envelope has finished, or (without envelopes) that has got to where it stops.
+    def free_ended(self):
+        # backwards, so the voice moved into a freed slot has already been checked.
+        for i in range(self.count - 1, -1, -1):
+            if not self.released[i]:
+                continue
+            if self.envelopes:
+                if self.voices[i].ended:
+                    self._free(i)
+            elif self.stop_at[i] is None or self.stop_at[i] <= 0:
+                self._free(i)
+
+    # renders and mixes the playing voices for the next num_frames frames, then puts back the ones that finished. the
+    # block that comes back is the pool's own buffer, which the next rend writes over.
+    def rend(self, num_frames):
+        if len(self._mix) < num_frames:
+            self._mix = np.zeros(num_frames)
+        mix = self._mix[:num_frames]
+        mix.fill(0)
+        for i in range(self.count):
+            stop = self.stop_at[i]
+            if stop is None:
+                mix += self.voices[i].rend(num_frames)
+            else:
+                mix[:stop] += self.voices[i].rend(num_frames)[:stop]
+                self.stop_at[i] = stop - num_frames
+        self.free_ended()
+        return mix
+
+
+# renders modulators that are shared by many voices (like the LFOs) exactly once per block. without it every voice that
+# pulls a shared LFO advances it again, so it runs faster the more notes are playing and does the same work N times.
+#
+# the blocks are rendered into one preallocated array (in dtype), which only gets made again if a bigger block or more
+# sources come along.
+#
+# with an interval, the sources run at a control rate instead: only a point every interval frames is rendered (see
+# control_points), and a source's block is only drawn in between them if something asks for it.
+class ModulationBus:
+    def __init__(self, sources, dtype=np.float64, interval=1):
+        self.sources = sources
+        self.interval = interval
+        self._points = np.zeros((len(sources), 0), dtype=dtype)
+        self._buffers = np.zeros((len(sources), 0), dtype=dtype)
+        self._interpolator = Interpolator(interval, dtype=dtype) if interval > 1 else None
+        self._num_frames = 0
+        self._num_points = 0
+        # the sources whose blocks have been drawn in since the last advance
+        self._drawn = [False] * len(sources)
+
+    # renders every source for the next block, and keeps the result until the next advance.
+    def advance(self, num_frames):
+        num_points = control_points(num_frames, self.interval)
+        rows, size = self._points.shape
+        if rows < len(self.sources) or size < num_points:
+            rows = max(rows, len(self.sources))
+            self._points = np.zeros((rows, max(size, num_points)), dtype=self._points.dtype)
+            self._drawn = [False] * rows
+        self._num_frames = num_frames
+        self._num_points = num_points
+        for index, source in enumerate(self.sources):
+            if self.interval > 1:
+                source.rend_points(self._points[index, :num_points], self.interval, num_frames)
+                self._drawn[index] = False
+            else:
+                source.rend_into(self._points[index, :num_frames])
+
+    # the current points of source index. without an interval that's the block itself.
+    def points(self, index):
+        return self._points[index, :self._num_points]
+
+    # the current block of source index
+    def block(self, index):
+        if self.interval <= 1:
+            return self._points[index, :self._num_frames]
+        rows, size = self._buffers.shape
+        if rows < len(self._points) or size < self._num_frames:
+            self._buffers = np.zeros((len(self._points), max(size, self._num_frames)), dtype=self._buffers.dtype)
+        block = self._buffers[index, :self._num_frames]
+        if not self._drawn[index]:
+            self._interpolator.into(self.points(index), block)
+            self._drawn[index] = True
+        return block
+
+    def tap(self, index):
+        return BusTap(self, index)
+
+
+# goes in a voice's modulator lists in place of a shared modulator. it hands back the bus's block for that source
+# rather than rendering it again, so every voice gets the same buffer.
+class BusTap:
+    def __init__(self, bus, index):
+        self.bus = bus
+        self.index = index
 
+    def rend(self, num_frames):
+        return self.bus.block(self.index)[:num_frames]
+
+
+# the level of an ADSR envelope t samples after the note started. attack, decay and release are lengths in samples.
+# release_t is the sample the release was triggered on (inf if it hasn't been yet) and release_val is the level
+# it releases from. everything broadcasts, so t can be a whole block (or a 2d array of blocks for many voices).
+def adsr_curve(t, attack, decay, sustain, release, release_t=np.inf, release_val=0.0):
+    t = np.asarray(t, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # attack goes from 0 up to 1
+        vals = np.where(t < attack, t / attack, sustain)
+        # decay goes from 1 down to the sustain level
+        decaying = 1 - (t - attack) * (1 - sustain) / decay
+        vals = np.where((t >= attack) & (t < attack + decay), decaying, vals)
+        # release goes from release_val down to 0, and stays there
+        since_release = t - release_t
+        releasing = release_val * (1 - since_release / release)
+        vals = np.where(since_release >= 0, np.where(since_release < release, releasing, 0.0), vals)
+    return vals
+
+
+# adsr_curve for a single time before any release, in plain python so it doesn't make any arrays.
+def adsr_level(t, attack, decay, sustain):
+    if t < attack:
+        return t / attack
+    if t < attack + decay:
+        return 1 - (t - attack) * (1 - sustain) / decay
+    return sustain
+
+
+# with a control_interval the curve is only worked out every that many frames, and drawn in with straight lines
+# between (see control_points). the curve is straight lines anyway, so that's exact apart from the intervals its
+# corners fall inside, which are worked out again every frame.
 class ADSREnvelope:
+    __slots__ = ("attack_duration", "decay_duration", "sustain_level", "release_duration", "_sample_rate",
+                 "control_interval", "_interpolator", "val", "ended", "_t", "_release_t", "_release_val")
+
     def __init__(self, attack_duration=0.05, decay_duration=0.2, sustain_level=0.7, \
-                 release_duration=0.3, sample_rate=44100):
+                 release_duration=0.3, sample_rate=44100, control_interval=1):
         self.attack_duration = attack_duration
         self.decay_duration = decay_duration
         self.sustain_level = sustain_level
         self.release_duration = release_duration
         self._sample_rate = sample_rate
+        self.control_interval = control_interval
+        self._interpolator = Interpolator(control_interval) if control_interval > 1 else None
         # test
         self.val = 0
         self.ended = False
-        self.stepper = self.get_ads_stepper()
-
-    # gets the attack, decay, and sustain when the note is initially created
-    def get_ads_stepper(self):
-        steppers = []
-        # if there is any attack, create an iterator
-        if self.attack_duration > 0:
-            steppers.append(itertools.count(start=0, \
-                                            step=1 / (self.attack_duration * self._sample_rate)))
-        # if the decay is not zero, create an iterator for it
-        if self.decay_duration > 0:
-            steppers.append(itertools.count(start=1, \
-                                            step=-(1 - self.sustain_level) / (self.decay_duration * self._sample_rate)))
-
-        while True:
-            l = len(steppers)
-            if l > 0:
-                val = next(steppers[0])
-                if l == 2 and val > 1:
-                    steppers.pop(0)
-                    val = next(steppers[0])
-                elif l == 1 and val < self.sustain_level:
-                    steppers.pop(0)
-                    val = self.sustain_level
-            else:
-                val = self.sustain_level
-            yield val
-
-    # when trigger_release is called, it changes the stepper to the release stepper, which starts at the current val
-    # and goes to zero.
-    def get_r_stepper(self):
-        val = 1
-        if self.release_duration > 0:
-            release_step = - self.val / (self.release_duration * self._sample_rate)
-            stepper = itertools.count(self.val, step=release_step)
-        else:
-            val = -1
-        while True:
-            if val <= 0:
-                self.ended = True
-                val = 0
-            else:
-                val = next(stepper)
-            yield val
+        # how many samples have been rendered since the note started
+        self._t = 0
+        # the sample the release starts on, and the level it starts from.
+        self._release_t = np.inf
+        self._release_val = 0.0
+
+    # starts the envelope again for a new note, with new lengths if they're given.
+    def reset(self, attack_duration=None, decay_duration=None, sustain_level=None, release_duration=None):
+        if attack_duration is not None:
+            self.attack_duration = attack_duration
+        if decay_duration is not None:
+            self.decay_duration = decay_duration
+        if sustain_level is not None:
+            self.sustain_level = sustain_level
+        if release_duration is not None:
+            self.release_duration = release_duration
+        self.val = 0
+        self.ended = False
+        self._t = 0
+        self._release_t = np.inf
+        self._release_val = 0.0
 
-    # def __iter__(self):
-    #     self.val = 0
-    #     self.ended = False
-    #     self.stepper = self.get_ads_stepper()
-    #     return self
+    # whether the release has been started
+    @property
+    def released(self):
+        return self._release_t != np.inf
+
+    # the envelope lengths in samples
+    def _segments(self):
+        sr = self._sample_rate
+        return self.attack_duration * sr, self.decay_duration * sr, self.sustain_level, self.release_duration * sr
+
+    # renders the envelope for the next num_frames frames. any segment boundaries (including a release
+    # that was triggered part way through the block) land on the exact sample they should.
+    def render(self, num_frames):
+        attack, decay, sustain, release = self._segments()
+        interval = self.control_interval
+        if interval > 1 and num_frames:
+            t = self._t + np.arange(control_points(num_frames, interval)) * interval
+            points = adsr_curve(t, attack, decay, sustain, release, self._release_t, self._release_val)
+            vals = self._interpolator.into(points, np.empty(num_frames))
+            for corner in (attack, attack + decay, self._release_t, self._release_t + release):
+                corner -= self._t
+                if 0 < corner < num_frames and corner % interval:
+                    start = int(corner // interval) * interval
+                    t = np.arange(self._t + start, self._t + min(start + interval, num_frames))
+                    vals[start:start + len(t)] = adsr_curve(t, attack, decay, sustain, release, self._release_t,
+                                                            self._release_val)
+        else:
+            t = np.arange(self._t, self._t + num_frames)
+            vals = adsr_curve(t, attack, decay, sustain, release, self._release_t, self._release_val)
+        self._t += num_frames
+        if num_frames:
+            self.val = vals[-1]
+        # the release has finished somewhere in (or before) this block.
+        if self._t >= self._release_t + release:
+            self.ended = True
+        return vals
 
     def __next__(self):
-        self.val = next(self.stepper)
-        return self.val
+        return self.render(1)[0]
 
-    def trigger_release(self):
-        self.stepper = self.get_r_stepper()
+    # so that envelopes and oscillators can both be used as block modulators.
+    def rend(self, num_frames):
+        return self.render(num_frames)
+
+    # starts the release from whatever level the envelope is at. delay is how many frames into the
+    # next render it should happen, so that a note can be released part way through a block.
+    def trigger_release(self, delay=0):
+        attack, decay, sustain, release = self._segments()
+        release_t = self._t + delay
+        if self.released:
+            # already on its way down, so it carries on from there rather than jumping back up to the sustain curve
+            self._release_val = float(adsr_curve(release_t, attack, decay, sustain, release, self._release_t,
+                                                 self._release_val))
+        else:
+            self._release_val = adsr_level(release_t, attack, decay, sustain)
+        self._release_t = release_t
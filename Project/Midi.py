@@ -0,0 +1,297 @@
+# midi input: standard midi files streamed a block at a time, and live midi ports.
+#
+# a MidiFilePlayer reads a file as it plays, never all at once: every track is read through its own small buffer and
+# the tracks are merged in time order as they go, so a huge file costs no more memory than a small one. each block it
+# hands back the events that land in it with their exact frame offsets, the same way EventQueue.drain does, so the
+# render loop can take its events from either.
+#
+# a MidiInput takes messages from a live port and pushes them onto an EventQueue, like the keyboard does. the port is
+# a backend from `backends`: "rtmidi" for real (or virtual) ports through python-rtmidi, or "loopback", which just
+# plays back whatever is sent to it, for running without any midi hardware.
+#
+# note ons become note_on events with the velocity as the amplitude, note offs become note_off events, and the
+# controllers in control_params become param events (see SynthEngine.set_param). the key of a midi note is
+# (channel, note), so the same note on two channels plays two voices.
+
+import heapq
+import struct
+
+# the loudest a note can be, at velocity 127
+max_velocity_amp = 0.2
+# the longest attack, decay or release a controller can set, in seconds. the same as the gui's sliders.
+max_time = 10
+
+
+def _fraction(value):
+    return value / 127
+
+
+# controller values go up exponentially, like the gui's sliders, so there's more control over the short times.
+def _seconds(value):
+    return pow(max_time + 1, value / 127) - 1
+
+
+# the controllers that do something, as number: (parameter, how the 0 to 127 value maps onto it)
+control_params = {
+    1: ("pitch", _fraction),  # mod wheel: how far the pitch LFOs bend
+    7: ("amp", _fraction),  # volume
+    72: ("release", _seconds),
+    73: ("attack", _seconds),
+    75: ("decay", _seconds),
+}
+
+
+def velocity_amp(velocity):
+    return max_velocity_amp * velocity / 127
+
+
+# the engine event (kind, key, args) for a channel message, or None if it's one the synth doesn't use.
+def message_event(status, data1, data2=0):
+    kind = status & 0xF0
+    channel = status & 0x0F
+    if kind == 0x90 and data2 > 0:
+        return "note_on", (channel, data1), (data1, velocity_amp(data2))
+    # a note on with velocity 0 is a note off
+    if kind in (0x80, 0x90):
+        return "note_off", (channel, data1), ()
+    if kind == 0xB0 and data1 in control_params:
+        name, to_value = control_params[data1]
+        return "param", name, (to_value(data2),)
+    return None
+
+
+# reads part of a file a buffer at a time.
+class _ChunkReader:
+    def __init__(self, path, start, length, buffer_size=65536):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._left = length
+        self._buffer_size = buffer_size
+        self._buffer = b""
+        self._pos = 0
+
+    def _fill(self):
+        size = min(self._buffer_size, self._left)
+        if size <= 0:
+            raise EOFError
+        self._buffer = self._file.read(size)
+        if not self._buffer:
+            raise EOFError
+        self._left -= len(self._buffer)
+        self._pos = 0
+
+    def byte(self):
+        if self._pos >= len(self._buffer):
+            self._fill()
+        value = self._buffer[self._pos]
+        self._pos += 1
+        return value
+
+    def read(self, n):
+        data = bytearray()
+        while len(data) < n:
+            if self._pos >= len(self._buffer):
+                self._fill()
+            take = self._buffer[self._pos:self._pos + n - len(data)]
+            self._pos += len(take)
+            data += take
+        return bytes(data)
+
+    # a variable length quantity: 7 bits a byte, with the top bit set on every byte but the last
+    def vlq(self):
+        value = 0
+        while True:
+            byte = self.byte()
+            value = (value << 7) | (byte & 0x7F)
+            if not byte & 0x80:
+                return value
+
+    def close(self):
+        self._file.close()
+
+
+# the events of one track as (tick, order, event), where event is ("meta", type, data) or ("channel", status, data1,
+# data2). sysex is skipped.
+def _track_events(path, start, length, order):
+    reader = _ChunkReader(path, start, length)
+    tick = 0
+    running = None
+    try:
+        while True:
+            tick += reader.vlq()
+            byte = reader.byte()
+            if byte == 0xFF:
+                meta_type = reader.byte()
+                data = reader.read(reader.vlq())
+                yield tick, order, ("meta", meta_type, data)
+                if meta_type == 0x2F:
+                    return
+            elif byte in (0xF0, 0xF7):
+                reader.read(reader.vlq())
+            else:
+                if byte & 0x80:
+                    running = byte
+                    data1 = reader.byte()
+                elif running is None:
+                    raise ValueError("midi data without a status byte")
+                else:
+                    # running status: the status byte is left out when it's the same as the last one
+                    data1 = byte
+                status = running
+                data2 = 0 if status & 0xF0 in (0xC0, 0xD0) else reader.byte()
+                yield tick, order, ("channel", status, data1, data2)
+    except EOFError:
+        # a track without an end of track event just ends
+        return
+    finally:
+        reader.close()
+
+
+class MidiFile:
+    def __init__(self, path):
+        self.path = path
+        # where each track's data starts in the file, and how long it is
+        self.tracks = []
+        with open(path, "rb") as midi_file:
+            chunk_type, length = struct.unpack(">4sI", midi_file.read(8))
+            if chunk_type != b"MThd":
+                raise ValueError(path + " isn't a midi file")
+            self.format, num_tracks, self.division = struct.unpack(">HHH", midi_file.read(6))
+            midi_file.seek(8 + length)
+            # only the chunk headers are read here, the track data is skipped over.
+            while len(self.tracks) < num_tracks:
+                header = midi_file.read(8)
+                if len(header) < 8:
+                    break
+                chunk_type, length = struct.unpack(">4sI", header)
+                if chunk_type == b"MTrk":
+                    self.tracks.append((midi_file.tell(), length))
+                midi_file.seek(length, 1)
+
+    # every channel message in the file in time order, as (seconds, status, data1, data2).
+    def messages(self):
+        if self.division & 0x8000:
+            # smpte timing: frames per second (stored negative) and ticks per frame, so the tempo doesn't matter
+            frames_per_second = 256 - (self.division >> 8)
+            seconds_per_tick = 1 / (frames_per_second * (self.division & 0xFF))
+            follow_tempo = False
+        else:
+            # 120 bpm until a tempo event says otherwise
+            seconds_per_tick = 0.5 / self.division
+            follow_tempo = True
+        tracks = [_track_events(self.path, start, length, order) for order, (start, length) in enumerate(self.tracks)]
+        last_tick = 0
+        seconds = 0.0
+        for tick, _, event in heapq.merge(*tracks):
+            seconds += (tick - last_tick) * seconds_per_tick
+            last_tick = tick
+            if event[0] == "channel":
+                yield (seconds,) + event[1:]
+            elif event[1] == 0x51 and follow_tempo:
+                # microseconds per quarter note
+                tempo = int.from_bytes(event[2][:3], "big")
+                seconds_per_tick = tempo / 1e6 / self.division
+
+
+# plays a midi file a block at a time.
+class MidiFilePlayer:
+    def __init__(self, path):
+        self.file = MidiFile(path)
+        self._messages = self.file.messages()
+        self._next = next(self._messages, None)
+        # the frame the next block starts on
+        self.frame = 0
+
+    # whether every event in the file has been handed out
+    @property
+    def finished(self):
+        return self._next is None
+
+    # the events in the next num_frames frames, as (frame offset, kind, key, args).
+    def drain(self, num_frames, sample_rate):
+        end = self.frame + num_frames
+        events = []
+        while self._next is not None:
+            seconds, status, data1, data2 = self._next
+            frame = int(round(seconds * sample_rate))
+            if frame >= end:
+                break
+            event = message_event(status, data1, data2)
+            if event is not None:
+                events.append((max(frame - self.frame, 0),) + event)
+            self._next = next(self._messages, None)
+        self.frame = end
+        return events
+
+
+# stands in for a midi port: everything sent to it comes straight back in.
+class LoopbackBackend:
+    def __init__(self, port=None):
+        self.port = port
+        self._callback = None
+
+    def open(self, callback):
+        self._callback = callback
+
+    def send(self, message, timestamp=None):
+        if self._callback is not None:
+            self._callback(bytes(message), timestamp)
+
+    def close(self):
+        self._callback = None
+
+
+# a real midi input through python-rtmidi. port is the name (or part of it) or number of the port to open. without
+# one it opens a virtual port other programs can play into.
+class RtMidiBackend:
+    def __init__(self, port=None):
+        self.port = port
+        self._midi_in = None
+
+    def open(self, callback):
+        import rtmidi
+        self._midi_in = rtmidi.MidiIn()
+        if self.port is None:
+            self._midi_in.open_virtual_port("Brauch Synth")
+        else:
+            ports = self._midi_in.get_ports()
+            if isinstance(self.port, int):
+                index = self.port
+            else:
+                matches = [i for i, name in enumerate(ports) if self.port in name]
+                if not matches:
+                    raise ValueError("no midi port called {!r} (there's {})".format(self.port, ", ".join(ports)))
+                index = matches[0]
+            self._midi_in.open_port(index)
+        # rtmidi calls back on its own thread with (message, seconds since the last one). the arrival time is what
+        # matters, so the queue stamps it.
+        self._midi_in.set_callback(lambda event, data=None: callback(bytes(event[0]), None))
+
+    def close(self):
+        if self._midi_in is not None:
+            self._midi_in.close_port()
+            self._midi_in = None
+
+
+backends = {"loopback": LoopbackBackend, "rtmidi": RtMidiBackend}
+
+
+# passes the messages from a live port onto an EventQueue.
+class MidiInput:
+    def __init__(self, queue, backend):
+        self.queue = queue
+        self.backend = backend
+
+    def _on_message(self, message, timestamp=None):
+        if len(message) < 2 or message[0] >= 0xF0:
+            return
+        event = message_event(message[0], message[1], message[2] if len(message) > 2 else 0)
+        if event is not None:
+            kind, key, args = event
+            self.queue.push(kind, key, *args, timestamp=timestamp)
+
+    def start(self):
+        self.backend.open(self._on_message)
+
+    def stop(self):
+        self.backend.close()
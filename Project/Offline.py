@@ -0,0 +1,142 @@
+# renders the synth without an audio device, keyboard or gui. give it a list of timestamped events and it renders
+# them as fast as it can, to a numpy array or a wav file.
+#
+# an event is a tuple of (time in seconds, kind, *args):
+#   (t, "note_on", key) or (t, "note_on", key, note)  - the MIDI note defaults to the key's in notes.key_notes, and a
+#                                                       key that's a number is taken as the note itself
+#   (t, "note_off", key)
+#   (t, "param", name, value)  - see SynthEngine.set_param
+#
+# from the command line, the events are a json list of lists:
+#   python -m Project.Offline events.json out.wav
+# or a standard midi file, which is streamed through the engine and into the wav a block at a time:
+#   python -m Project.Offline song.mid out.wav
+
+import argparse
+import json
+import time
+import wave
+
+import numpy as np
+
+from .Engine import SynthEngine
+from .Midi import MidiFilePlayer
+from .notes import key_notes
+
+
+# writes samples (floats from -1 to 1, or int16) to a wav file. (frames, 2) samples make a stereo one.
+def write_wav(path, samples, sample_rate=44100):
+    if samples.dtype != np.int16:
+        samples = np.int16(np.clip(samples, -1, 1) * 32767)
+    with wave.open(path, "wb") as wav_file:
+        wav_file.setnchannels(samples.shape[1] if samples.ndim > 1 else 1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(samples.tobytes())
+
+
+class OfflineRenderer:
+    def __init__(self, engine=None, sample_rate=44100, block_size=256, amp=1):
+        if engine is None:
+            engine = SynthEngine(sample_rate=sample_rate)
+            engine.amp = amp
+        self.engine = engine
+        self.sample_rate = engine.sample_rate
+        self.block_size = block_size
+        # how many seconds of audio the last render made per second it took
+        self.real_time_factor = None
+
+    # hands an event to the engine the same way the live synth does (SynthEngine.apply_event). the only thing added
+    # here is the note a note_on without one defaults to.
+    def _apply(self, event):
+        kind, key, args = event[1], event[2], tuple(event[3:])
+        if kind == "note_on" and not args:
+            args = (key if isinstance(key, int) else key_notes[key],)
+        self.engine.apply_event(kind, key, args)
+
+    # renders events and returns the samples. if no duration (in seconds) is given, it carries on after the last
+    # event until every note has finished its release, or max_tail seconds have passed.
+    def render(self, events, duration=None, max_tail=10.0, amp_scale=0.2, max_amp=0.8):
+        events = sorted(events, key=lambda event: event[0])
+        event_frames = [int(round(event[0] * self.sample_rate)) for event in events]
+        if duration is not None:
+            end = int(round(duration * self.sample_rate))
+        else:
+            last = event_frames[-1] if events else 0
+            end = last + int(max_tail * self.sample_rate)
+
+        # rendered straight into the output, and trimmed to however long it turned out at the end.
+        channels = self.engine.channels
+        samples = np.zeros(end if channels == 1 else (end, channels), dtype=self.engine.dtype)
+        frame = 0
+        next_event = 0
+        start_time = time.perf_counter()
+        while True:
+            # every event lands on its exact frame, so a block gets split wherever one happens.
+            while next_event < len(events) and event_frames[next_event] <= frame:
+                self._apply(events[next_event])
+                next_event += 1
+            if frame >= end:
+                break
+            if duration is None and next_event == len(events) and not self.engine.voices.count:
+                break
+            num_frames = min(self.block_size, end - frame)
+            if next_event < len(events):
+                num_frames = min(num_frames, event_frames[next_event] - frame)
+            self.engine.render(num_frames, amp_scale, out=samples[frame:frame + num_frames])
+            frame += num_frames
+        elapsed = time.perf_counter() - start_time
+
+        samples = samples[:frame].clip(-max_amp, max_amp)
+        self.real_time_factor = (frame / self.sample_rate) / elapsed if elapsed > 0 else float("inf")
+        return samples
+
+    # renders events into a wav file, and returns the real time factor.
+    def render_to_wav(self, events, path, duration=None, **kwargs):
+        samples = self.render(events, duration=duration, **kwargs)
+        write_wav(path, samples, self.sample_rate)
+        return self.real_time_factor
+
+    # plays a midi file into a wav file, a block at a time, so neither is ever held in memory whole. it carries on
+    # after the file ends until every note has finished its release, or max_tail seconds have passed. returns the
+    # real time factor.
+    def render_midi_to_wav(self, midi_path, path, max_tail=10.0, amp_scale=0.2, max_amp=0.8):
+        player = MidiFilePlayer(midi_path)
+        frame = 0
+        tail_end = None
+        start_time = time.perf_counter()
+        with wave.open(path, "wb") as wav_file:
+            wav_file.setnchannels(self.engine.channels)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(self.sample_rate)
+            while True:
+                if player.finished:
+                    if tail_end is None:
+                        tail_end = frame + int(max_tail * self.sample_rate)
+                    if frame >= tail_end or not self.engine.voices.count:
+                        break
+                events = player.drain(self.block_size, self.sample_rate)
+                wav_file.writeframes(self.engine.get_samples(self.block_size, amp_scale, max_amp, events))
+                frame += self.block_size
+        elapsed = time.perf_counter() - start_time
+        self.real_time_factor = (frame / self.sample_rate) / elapsed if elapsed > 0 else float("inf")
+        return self.real_time_factor
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="render a list of note events to a wav file")
+    parser.add_argument("events", help="json file with a list of [time, kind, *args] events, or a .mid file")
+    parser.add_argument("output", help="the wav file to write")
+    parser.add_argument("--duration", type=float, default=None, help="length in seconds (default: until silent)")
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--block-size", type=int, default=256)
+    args = parser.parse_args()
+
+    renderer = OfflineRenderer(sample_rate=args.sample_rate, block_size=args.block_size)
+    if args.events.lower().endswith((".mid", ".midi")):
+        rtf = renderer.render_midi_to_wav(args.events, args.output)
+    else:
+        with open(args.events) as events_file:
+            events = json.load(events_file)
+        rtf = renderer.render_to_wav(events, args.output, duration=args.duration)
+    print("rendered {} at {:.1f}x real time".format(args.output, rtf))
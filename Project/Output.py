@@ -0,0 +1,375 @@
+# where the rendered audio goes. the render thread writes blocks into a RingBuffer a few blocks ahead, and a sink
+# pulls from it whenever it needs more: from the sound card's callback (PyAudioSink), or from its own thread for
+# running without a sound card (NullSink, FileSink).
+
+import threading
+import time
+import wave
+
+import numpy as np
+
+
+# a preallocated ring of int16 frames with one writer (the render thread) and one reader (the sink). the writer only
+# ever moves the write count and the reader only the read count, so neither has to take a lock. in stereo it holds
+# the samples interleaved, and everything here counts samples (two to a frame) rather than frames.
+class RingBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buffer = np.zeros(capacity, dtype=np.int16)
+        # how many frames have ever been written and read. the difference is what's waiting to be played.
+        self._written = 0
+        self._read = 0
+        # set by the reader when it frees up space, and by the writer when there's new audio.
+        self.space_event = threading.Event()
+        self.data_event = threading.Event()
+        # how many times the reader wanted more than there was
+        self.underruns = 0
+
+    def available(self):
+        return self._written - self._read
+
+    def space(self):
+        return self.capacity - self.available()
+
+    # copies samples in. the writer has to check there's space() first.
+    def write(self, samples):
+        n = len(samples)
+        start = self._written % self.capacity
+        first = min(n, self.capacity - start)
+        self._buffer[start:start + first] = samples[:first]
+        self._buffer[:n - first] = samples[first:]
+        self._written += n
+        self.data_event.set()
+
+    # the next num_frames frames of the ring to write into directly, if they don't wrap around the end (otherwise
+    # None, and it has to go through write). commit() them once they're filled in.
+    def reserve(self, num_frames):
+        start = self._written % self.capacity
+        if start + num_frames > self.capacity:
+            return None
+        return self._buffer[start:start + num_frames]
+
+    def commit(self, num_frames):
+        self._written += num_frames
+        self.data_event.set()
+
+    # fills out with the next frames. if there aren't enough the rest is silence and it counts as an underrun.
+    # returns how many frames were real audio.
+    def read_into(self, out):
+        n = min(len(out), self.available())
+        start = self._read % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._buffer[start:start + first]
+        out[first:n] = self._buffer[:n - first]
+        if n < len(out):
+            out[n:] = 0
+            self.underruns += 1
+        self._read += n
+        self.space_event.set()
+        return n
+
+    # blocks the writer until there's room for num_frames (or timeout seconds pass).
+    def wait_for_space(self, num_frames, timeout=None):
+        # clear before checking, so a read that happens in between still wakes it up.
+        self.space_event.clear()
+        if self.space() >= num_frames:
+            return True
+        return self.space_event.wait(timeout)
+
+
+# plays the ring buffer through the sound card, using a pyaudio callback stream so the sound card asks for audio when
+# it needs it instead of the render thread blocking on stream.write.
+class PyAudioSink:
+    def __init__(self, sample_rate=44100, block_size=256, channels=1):
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.channels = channels
+        self._out = np.zeros(block_size * channels, dtype=np.int16)
+        self._pyaudio = None
+        self.stream = None
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        count = frame_count * self.channels
+        if count > len(self._out):
+            self._out = np.zeros(count, dtype=np.int16)
+        out = self._out[:count]
+        self.ring.read_into(out)
+        # pyaudio takes the array as it is (it only needs the buffer), so there's no bytes object to make every time.
+        return out, self._continue
+
+    def start(self, ring):
+        import pyaudio
+        self.ring = ring
+        self._continue = pyaudio.paContinue
+        self._pyaudio = pyaudio.PyAudio()
+        self.stream = self._pyaudio.open(
+            rate=self.sample_rate,
+            channels=self.channels,
+            format=pyaudio.paInt16,
+            output=True,
+            frames_per_buffer=self.block_size,
+            stream_callback=self._callback
+        )
+        self.stream.start_stream()
+
+    # how long (in seconds) audio waits in the sound card's own buffers, on top of what's in the ring.
+    def latency(self):
+        if self.stream is not None:
+            return self.stream.get_output_latency()
+        return self.block_size / self.sample_rate
+
+    def stop(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+            self._pyaudio.terminate()
+            self.stream = None
+
+
+# pulls from the ring buffer on its own thread and throws the audio away. with realtime it pulls a block every block
+# period like a sound card would, otherwise as fast as the render thread can keep up, which is handy for timing.
+class NullSink:
+    def __init__(self, sample_rate=44100, block_size=256, realtime=True, channels=1):
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.realtime = realtime
+        self.channels = channels
+        # frames of real audio pulled from the ring (not the silence it's given when the ring runs dry)
+        self.frames = 0
+        self._out = np.zeros(block_size * channels, dtype=np.int16)
+        self._stopping = False
+        self._thread = None
+
+    def _consume(self, out):
+        pass
+
+    def latency(self):
+        return self.block_size / self.sample_rate
+
+    def _run(self):
+        period = self.block_size / self.sample_rate
+        next_time = time.perf_counter()
+        while not self._stopping:
+            if self.realtime:
+                # keeps to the schedule rather than sleeping a period each time, so it doesn't drift.
+                next_time += period
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                self.ring.data_event.clear()
+                if self.ring.available() < len(self._out):
+                    self.ring.data_event.wait(0.1)
+                    continue
+            self.frames += self.ring.read_into(self._out) // self.channels
+            self._consume(self._out)
+
+    def start(self, ring):
+        self.ring = ring
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# the same as NullSink, but writes what it pulls into a wav file.
+class FileSink(NullSink):
+    def __init__(self, path, sample_rate=44100, block_size=256, realtime=False, channels=1):
+        super().__init__(sample_rate=sample_rate, block_size=block_size, realtime=realtime, channels=channels)
+        self.path = path
+        self._wav = None
+
+    def _consume(self, out):
+        self._wav.writeframes(out.tobytes())
+
+    def start(self, ring):
+        self._wav = wave.open(self.path, "wb")
+        self._wav.setnchannels(self.channels)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(self.sample_rate)
+        super().start(ring)
+
+    def stop(self):
+        super().stop()
+        if self._wav is not None:
+            self._wav.close()
+            self._wav = None
+
+
+# records what's played to a wav file without the render thread going anywhere near the disk. every block is copied
+# into a ring buffer (a few seconds' worth, made up front), and a thread of its own takes them off in big batches and
+# writes them out through a large file buffer. the frame count in the header is only filled in once, when it stops.
+# if the disk stalls for longer than the ring holds, blocks are dropped from the recording (and counted) rather than
+# ever making the render thread wait, so recording can't cause a dropout, and a long session uses no more memory than
+# a short one.
+class WavRecorder:
+    # seconds is how much audio can be waiting to be written, and batch how many seconds are written at a time.
+    def __init__(self, path, sample_rate=44100, channels=1, seconds=2.0, batch=0.25, buffering=1 << 20):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.buffering = buffering
+        self.ring = RingBuffer(int(seconds * sample_rate) * channels)
+        self._batch = np.zeros(max(int(batch * sample_rate), 1) * channels, dtype=np.int16)
+        # how many frames have been written to the file, and dropped because the ring was full
+        self.frames = 0
+        self.dropped = 0
+        self._file = None
+        self._wav = None
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        self._file = open(self.path, "wb", buffering=self.buffering)
+        self._wav = wave.open(self._file, "wb")
+        self._wav.setnchannels(self.channels)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(self.sample_rate)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    # the render thread's side: copies a block of int16 samples in, or drops it if there isn't room.
+    def write(self, samples):
+        if self.ring.space() < len(samples):
+            self.dropped += len(samples) // self.channels
+            return False
+        self.ring.write(samples)
+        return True
+
+    def _run(self):
+        ring = self.ring
+        while True:
+            ring.data_event.clear()
+            if ring.available() < len(self._batch) and not self._stopping:
+                # waits for a batch to build up, but not so long that stopping has to wait for it
+                ring.data_event.wait(0.1)
+            n = min(ring.available(), len(self._batch))
+            if n:
+                batch = self._batch[:n]
+                ring.read_into(batch)
+                # writeframesraw leaves the header alone, unlike writeframes, which seeks back to fix it every time
+                self._wav.writeframesraw(batch)
+                self.frames += n // self.channels
+            elif self._stopping:
+                break
+
+    # writes whatever's left, fixes up the header and closes the file.
+    def stop(self):
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._wav is not None:
+            self._wav.close()
+            self._file.close()
+            self._wav = None
+            self._file = None
+
+
+# works out, while the synth plays, how big the render blocks should be and how many of them to keep rendered ahead, for
+# whatever machine it's on and however much it's being asked to play. after every block it's told how long rendering
+# took, as a share of the time the block lasts (its load), and every window blocks it looks back over them:
+#   - a high load on average means the blocks are too small to be worth the overhead of rendering one, so they double
+#   - a block that took over grow_at of the blocks already waiting to be heard (blocks_ahead - 1 of them when it
+#     starts), or an underrun (which it hears about straight away), means there isn't enough slack for the spikes, so
+#     another block is kept ahead
+#   - a low load the whole time, even against one block less, for shrink_after windows in a row means there's room to
+#     spare, so it steps back: a block less ahead, or half the size
+# it never goes outside min_latency to max_latency (in seconds) of audio waiting in the ring. shrinking only happens
+# well below the load that grows it again, and only after a run of quiet windows (which starts over whenever it
+# grows). if it has to grow again before that many windows have passed since it shrank, the shrink didn't hold, so the
+# run it waits for next time is twice as long. that way it doesn't flip back and forth, or keep going back to a setting
+# that just underran.
+class LatencyTuner:
+    def __init__(self, sample_rate=44100, block_size=256, blocks_ahead=3, min_latency=0.005, max_latency=0.1,
+                 min_block=64, max_block=2048, window=64, grow_at=0.6, shrink_at=0.25, shrink_after=8):
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.blocks_ahead = blocks_ahead
+        self.min_latency = min_latency
+        self.max_latency = max_latency
+        self.min_block = min_block
+        self.max_block = max_block
+        self.window = window
+        self.grow_at = grow_at
+        self.shrink_at = shrink_at
+        self.shrink_after = shrink_after
+        # the load of the blocks so far in this window
+        self._loads = np.zeros(window)
+        self._count = 0
+        self._underruns = 0
+        # quiet windows in a row, how many it takes to shrink, and windows since it last did (None if it's grown since)
+        self._quiet = 0
+        self._needed = shrink_after
+        self._since_shrink = None
+        # how many times it's changed anything
+        self.changes = 0
+
+    # seconds of audio waiting in the ring, when it's full.
+    @property
+    def latency(self):
+        return self.block_size * self.blocks_ahead / self.sample_rate
+
+    def _fits(self, block_size, blocks_ahead):
+        return (self.min_block <= block_size <= self.max_block and blocks_ahead >= 2
+                and self.min_latency <= block_size * blocks_ahead / self.sample_rate <= self.max_latency)
+
+    # moves to the first of choices, (block_size, blocks_ahead), that's within the limits. returns whether it did.
+    def _change(self, *choices):
+        self._count = 0
+        for block_size, blocks_ahead in choices:
+            if self._fits(block_size, blocks_ahead):
+                self.block_size = block_size
+                self.blocks_ahead = blocks_ahead
+                self.changes += 1
+                return True
+        return False
+
+    def _grow(self, *choices):
+        self._quiet = 0
+        if self._since_shrink is not None and self._since_shrink < self._needed:
+            self._needed *= 2
+        self._since_shrink = None
+        return self._change(*choices)
+
+    # call after every block with how long it took to render (seconds), how many frames it was, and the ring's
+    # underrun count. returns True if the block size or blocks ahead changed.
+    def update(self, render_time, num_frames, underruns):
+        self._loads[self._count] = render_time * self.sample_rate / num_frames
+        self._count += 1
+        size, ahead = self.block_size, self.blocks_ahead
+        if underruns > self._underruns:
+            self._underruns = underruns
+            return self._grow((size, ahead + 1), (size * 2, ahead))
+        if self._count < self.window:
+            return False
+        if self._since_shrink is not None:
+            self._since_shrink += 1
+        loads = self._loads
+        peak = loads.max()
+        if loads.mean() > self.grow_at:
+            return self._grow((size * 2, ahead), (size, ahead + 1))
+        if peak > self.grow_at * (ahead - 1):
+            return self._grow((size, ahead + 1), (size * 2, ahead))
+        self._count = 0
+        if peak >= self.shrink_at * max(ahead - 2, 1):
+            self._quiet = 0
+            return False
+        self._quiet += 1
+        if self._quiet < self._needed:
+            return False
+        self._quiet = 0
+        if not self._change((size, ahead - 1), (size // 2, ahead)):
+            return False
+        self._since_shrink = 0
+        return True
+
+
+sinks = {"pyaudio": PyAudioSink, "null": NullSink, "file": FileSink}
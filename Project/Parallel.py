@@ -0,0 +1,252 @@
+# renders the voices on several processes, so big chords aren't stuck on the one core the GIL allows. each worker
+# process owns a VoiceBank with its share of the voices and renders it into shared memory, and the main process only
+# has to add the workers' blocks together.
+#
+# the workers render a block behind: while the main process mixes block k, they are already rendering block k + 1.
+# so the output is always block_size frames late, but the main process never sits waiting on a worker that has only
+# just started. note events keep their exact frame, they just come out block_size frames later like everything else.
+
+import collections
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .FM import FMVoiceBank, operators_from_config
+from .Tuning import Tuning
+from .Voices import VoiceBank
+
+# each slot in a worker's shared memory is the amp modulation, then the freq modulation, then the output (which is
+# channels frames wide), block_size frames of each.
+def _slot_views(buffers, slot, block_size, channels):
+    amp_mod = buffers[slot, :block_size]
+    freq_mod = buffers[slot, block_size:2 * block_size]
+    output = buffers[slot, 2 * block_size:]
+    return amp_mod, freq_mod, output if channels == 1 else output.reshape(block_size, channels)
+
+
+def _worker(conn, shm_name, slots, block_size, operators, options):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    channels = options["channels"]
+    buffers = np.ndarray((slots, (2 + channels) * block_size), dtype=options["dtype"], buffer=shm.buf)
+    if operators is not None:
+        voices = FMVoiceBank(operators=operators, **options)
+    else:
+        voices = VoiceBank(**options)
+    voices.prepare(block_size)
+    # note events waiting for the block they fall in, as (frame, kind, args)
+    pending = []
+    try:
+        while True:
+            message = conn.recv()
+            kind = message[0]
+            if kind == "stop":
+                break
+            if kind == "event":
+                pending.append(message[1:])
+                continue
+
+            _, slot, start, use_freq_mod = message
+            end = start + block_size
+            amp_mod, freq_mod, output = _slot_views(buffers, slot, block_size, channels)
+            if not use_freq_mod:
+                freq_mod = None
+            # render up to each event that lands in this block, then apply it.
+            frame = 0
+            due = sorted((event for event in pending if event[0] < end), key=lambda event: event[0])
+            pending = [event for event in pending if event[0] >= end]
+            for event_frame, event_kind, args in due:
+                offset = max(event_frame - start, 0)
+                if offset > frame:
+                    voices.render(offset - frame, amp_mod[frame:offset],
+                                  None if freq_mod is None else freq_mod[frame:offset], out=output[frame:offset])
+                    frame = offset
+                getattr(voices, event_kind)(*args)
+            if frame < block_size:
+                voices.render(block_size - frame, amp_mod[frame:], None if freq_mod is None else freq_mod[frame:],
+                              out=output[frame:])
+            conn.send((slot, voices.count))
+    finally:
+        del buffers
+        shm.close()
+
+
+# a drop in for VoiceBank that spreads the voices over worker processes.
+class ParallelVoices:
+    def __init__(self, processes=2, max_voices=32, sample_rate=44100, steal_policy="oldest", block_size=256,
+                 slots=4, dtype=np.float64, tuning=None, control_interval=1, operators=None, unison=1, detune=15.0,
+                 spread=1.0, channels=1):
+        self.processes = processes
+        self.max_voices = max_voices
+        self.sample_rate = sample_rate
+        self.block_size = block_size
+        self.slots = slots
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        self.stats = None
+        self.tuning = (tuning if tuning is not None else Tuning.equal(sample_rate=sample_rate)).at_sample_rate(
+            sample_rate)
+
+        # the workers get FM operators as their settings, which is all they need to make them again
+        if operators is not None:
+            operators = [operator.config() for operator in operators_from_config(operators, sample_rate)]
+
+        context = multiprocessing.get_context("spawn")
+        options = dict(max_voices=-(-max_voices // processes), sample_rate=sample_rate, steal_policy=steal_policy,
+                       dtype=self.dtype, tuning=self.tuning, control_interval=control_interval, unison=unison,
+                       detune=detune, spread=spread, channels=channels)
+        slot_size = (2 + channels) * block_size
+        slot_bytes = slots * slot_size * self.dtype.itemsize
+        self._shms = []
+        self._buffers = []
+        self._conns = []
+        self._workers = []
+        for _ in range(processes):
+            shm = shared_memory.SharedMemory(create=True, size=slot_bytes)
+            parent_conn, child_conn = context.Pipe()
+            worker = context.Process(target=_worker, daemon=True,
+                                     args=(child_conn, shm.name, slots, block_size, operators, options))
+            worker.start()
+            self._shms.append(shm)
+            self._buffers.append(np.ndarray((slots, slot_size), dtype=self.dtype, buffer=shm.buf))
+            self._conns.append(parent_conn)
+            self._workers.append(worker)
+
+        # how many voices each worker had after its last block, and the frames of the notes sent to it since
+        self._counts = [0] * processes
+        self._sent = [collections.deque() for _ in range(processes)]
+        # the worker playing each key that's held down, so everything for that key goes to the same one
+        self._owners = {}
+
+        # the modulation that's been given to render but not sent to the workers yet
+        self._in_amp = np.ones(block_size, dtype=self.dtype)
+        self._in_freq = np.ones(block_size, dtype=self.dtype)
+        self._in_len = 0
+        self._in_has_freq = False
+        # every frame ever given to render, so events know which frame they land on
+        self._in_frames = 0
+
+        # the blocks sent to the workers that haven't been collected yet, as (slot, first frame)
+        self._outstanding = collections.deque()
+        self._next_slot = 0
+        # mixed audio waiting to be returned. it starts with a block of silence, which is the delay.
+        self._out = self._zeros(block_size * (slots + 2))
+        self._out_len = block_size
+        # what render hands back when it isn't given somewhere to put it
+        self._mix = self._zeros(block_size)
+
+    # a buffer for n frames of every channel
+    def _zeros(self, n):
+        return np.zeros(n if self.channels == 1 else (n, self.channels), dtype=self.dtype)
+
+    @property
+    def count(self):
+        return sum(self._counts) + sum(len(sent) for sent in self._sent)
+
+    def __len__(self):
+        return self.count
+
+    def _broadcast(self, message):
+        for conn in self._conns:
+            conn.send(message)
+
+    def note_on(self, key, note, amp=0.2, wave_shape=0, attack=0.05, decay=0.2, sustain=0.7, release=0.3):
+        # a key that's already held goes back to the worker holding it (which ignores it, like a VoiceBank would),
+        # otherwise it goes to whichever worker has the fewest voices.
+        worker = self._owners.get(key)
+        if worker is None:
+            loads = [count + len(sent) for count, sent in zip(self._counts, self._sent)]
+            worker = loads.index(min(loads))
+            self._owners[key] = worker
+        self._sent[worker].append(self._in_frames)
+        self._conns[worker].send(("event", self._in_frames, "note_on",
+                                  (key, note, amp, wave_shape, attack, decay, sustain, release)))
+
+    # only the worker holding key gets it. (a key that isn't held has nothing to release.)
+    def note_off(self, key, delay=0):
+        worker = self._owners.pop(key, None)
+        if worker is not None:
+            self._conns[worker].send(("event", self._in_frames + delay, "note_off", (key,)))
+
+    def change_wave_shape(self, wave_shape):
+        self._broadcast(("event", self._in_frames, "change_wave_shape", (wave_shape,)))
+
+    def set_tuning(self, tuning):
+        self.tuning = tuning.at_sample_rate(self.sample_rate)
+        self._broadcast(("event", self._in_frames, "set_tuning", (self.tuning,)))
+
+    # waits for the oldest block sent to the workers, and adds it to the output.
+    def _collect(self):
+        start = self._outstanding.popleft()[1]
+        end = start + self.block_size
+        if self._out_len + self.block_size > len(self._out):
+            self._out = np.concatenate([self._out, self._zeros(len(self._out))])
+        mix = self._out[self._out_len:self._out_len + self.block_size]
+        mix[:] = 0
+        for worker, conn in enumerate(self._conns):
+            done_slot, count = conn.recv()
+            self._counts[worker] = count
+            # the notes that were in this block are in the count now.
+            sent = self._sent[worker]
+            while sent and sent[0] < end:
+                sent.popleft()
+            mix += _slot_views(self._buffers[worker], done_slot, self.block_size, self.channels)[2]
+        self._out_len += self.block_size
+
+    # sends the block of modulation that's been built up to every worker.
+    def _send(self):
+        if len(self._outstanding) >= self.slots - 1:
+            self._collect()
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % self.slots
+        for buffers in self._buffers:
+            amp_mod, freq_mod, _ = _slot_views(buffers, slot, self.block_size, self.channels)
+            amp_mod[:] = self._in_amp
+            freq_mod[:] = self._in_freq
+        start = self._in_frames - self._in_len
+        self._broadcast(("render", slot, start, self._in_has_freq))
+        self._outstanding.append((slot, start))
+        self._in_amp[:] = 1
+        self._in_freq[:] = 1
+        self._in_len = 0
+        self._in_has_freq = False
+
+    def render(self, num_frames, amp_mod=None, freq_mod=None, out=None):
+        # queue up the modulation for these frames, sending a block to the workers whenever there's a full one.
+        done = 0
+        while done < num_frames:
+            n = min(num_frames - done, self.block_size - self._in_len)
+            if amp_mod is not None:
+                self._in_amp[self._in_len:self._in_len + n] = amp_mod[done:done + n]
+            if freq_mod is not None:
+                self._in_freq[self._in_len:self._in_len + n] = freq_mod[done:done + n]
+                self._in_has_freq = True
+            self._in_len += n
+            self._in_frames += n
+            done += n
+            if self._in_len == self.block_size:
+                self._send()
+
+        # then hand back the frames from a block ago, waiting for the workers only if they aren't there yet.
+        while self._out_len < num_frames:
+            self._collect()
+        if out is None:
+            if len(self._mix) < num_frames:
+                self._mix = self._zeros(num_frames)
+            out = self._mix[:num_frames]
+        out[:] = self._out[:num_frames]
+        self._out[:self._out_len - num_frames] = self._out[num_frames:self._out_len]
+        self._out_len -= num_frames
+        if self.stats is not None:
+            self.stats.mark("mixing")
+        return out
+
+    def close(self):
+        self._broadcast(("stop",))
+        for worker in self._workers:
+            worker.join(timeout=1)
+        self._buffers = []
+        for shm in self._shms:
+            shm.close()
+            shm.unlink()
+        self._shms = []
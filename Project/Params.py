@@ -0,0 +1,68 @@
+# the synth's settings on their way from the gui thread to the render thread. the gui changes them whenever a slider
+# moves (which can be dozens of times a block while one's being dragged), and the render thread takes one snapshot of
+# all of them at the start of every block, so a block is never rendered half with the old settings and half with the
+# new. neither side takes a lock or waits on the other.
+#
+# it's double buffered: the gui writes a whole new set of values into the buffer the render thread isn't reading,
+# then flips which one is current. a sequence number goes up before and after every flip, so the render thread can
+# tell if the gui wrote over the buffer it was copying (which takes two flips in the time of one copy), and if so it
+# keeps the settings it had and tries again next block.
+
+
+class ParamStore:
+    # values is the settings by name, with the values they start at.
+    def __init__(self, values):
+        self.names = list(values)
+        self._index = {name: i for i, name in enumerate(self.names)}
+        initial = list(values.values())
+        self._buffers = [list(initial), list(initial)]
+        self._current = 0
+        # odd while the gui is writing a buffer
+        self._sequence = 0
+        # the gui's own copy, which set() changes
+        self._staged = list(initial)
+        # the render thread's: the snapshot it took last, one being copied, and the sequence it was taken at
+        self.snapshot = list(initial)
+        self._taking = list(initial)
+        self._taken = 0
+
+    # the gui thread's side
+
+    # what a setting was last set to.
+    def __getitem__(self, name):
+        return self._staged[self._index[name]]
+
+    def set(self, name, value):
+        self._staged[self._index[name]] = value
+        self.publish()
+
+    # sets several at once, which the render thread will only ever see together.
+    def update(self, values):
+        for name, value in values.items():
+            self._staged[self._index[name]] = value
+        self.publish()
+
+    def publish(self):
+        spare = 1 - self._current
+        self._sequence += 1
+        self._buffers[spare][:] = self._staged
+        self._current = spare
+        self._sequence += 1
+
+    # the render thread's side
+
+    # takes the newest snapshot, and returns the settings that changed since the last one as (name, value). nothing
+    # has usually changed, which only costs a comparison.
+    def take(self):
+        sequence = self._sequence
+        if sequence == self._taken or sequence % 2:
+            # nothing new, or the gui's in the middle of a publish: it'll be there next block
+            return ()
+        self._taking[:] = self._buffers[self._current]
+        if self._sequence - sequence > 2:
+            # published twice while it was being copied, so the second went over the buffer being copied
+            return ()
+        self._taken = sequence
+        changed = [(name, new) for name, old, new in zip(self.names, self.snapshot, self._taking) if old != new]
+        self.snapshot[:] = self._taking
+        return changed
@@ -0,0 +1,76 @@
+# a tap on the rendered audio for the gui's oscilloscope and level meters. the render thread publishes every block into
+# a small ring of preallocated slots (the block's waveform cut down to a fixed number of points, and its peak and rms
+# level), and the gui reads whatever's newest whenever its timer comes round. neither ever waits for the other, and
+# publishing doesn't allocate anything (unless the block size changes).
+#
+# it works like Output.RingBuffer: the render thread only moves the written count once a slot is filled in, and the
+# gui only reads slots that count says are done. the gui can be slow enough for the render thread to lap it and start
+# on a slot it's still copying, so it checks the count again afterwards and leaves that read for next time.
+
+import numpy as np
+
+
+class ScopeTap:
+    # points is how many values each waveform is cut down to, and slots how many blocks are kept for the gui to catch
+    # up on. stereo blocks are shown as the average of the two channels, with a meter for each.
+    def __init__(self, points=256, slots=16, channels=1, dtype=np.float64):
+        self.points = points
+        self.slots = slots
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        self.waves = np.zeros((slots, points), dtype=self.dtype)
+        self.peaks = np.zeros((slots, channels), dtype=self.dtype)
+        self.rms = np.zeros((slots, channels), dtype=self.dtype)
+        # how many blocks have ever been published and read
+        self._written = 0
+        self._read = 0
+        # the render thread's scratch: which frames of a block the points are, and room to work out the levels in
+        self._frames = 0
+        self._picks = np.zeros(points, dtype=np.intp)
+        self._picked = np.zeros((points, channels), dtype=self.dtype)
+        self._scratch = np.zeros((0, channels), dtype=self.dtype)
+
+    # the render thread's side: publishes a block of frames ((frames, channels) in stereo).
+    def publish(self, block):
+        n = len(block)
+        if n == 0:
+            return
+        if n != self._frames:
+            np.floor_divide(np.arange(self.points) * n, self.points, out=self._picks)
+            self._scratch = np.zeros((n, self.channels), dtype=self.dtype)
+            self._frames = n
+        frames = block.reshape(n, self.channels)
+        slot = self._written % self.slots
+        np.take(frames, self._picks, axis=0, out=self._picked)
+        np.mean(self._picked, axis=1, out=self.waves[slot])
+        scratch = self._scratch
+        np.abs(frames, out=scratch)
+        np.max(scratch, axis=0, out=self.peaks[slot])
+        np.square(frames, out=scratch)
+        np.mean(scratch, axis=0, out=self.rms[slot])
+        np.sqrt(self.rms[slot], out=self.rms[slot])
+        self._written += 1
+
+    # the gui's side: copies the newest waveform into wave, and the loudest peak and the overall rms of every block
+    # since the last read into peak and rms (one for each channel). returns False, leaving them alone, if nothing's
+    # been published since.
+    def read(self, wave, peak, rms):
+        written = self._written
+        if written == self._read:
+            return False
+        # the oldest slot that can't have been started on again yet
+        first = max(self._read, written - self.slots + 1)
+        wave[:] = self.waves[(written - 1) % self.slots]
+        peak[:] = 0
+        rms[:] = 0
+        for i in range(first, written):
+            slot = i % self.slots
+            np.maximum(peak, self.peaks[slot], out=peak)
+            rms += self.rms[slot] ** 2
+        if self._written >= first + self.slots:
+            # lapped while copying
+            return False
+        rms /= written - first
+        np.sqrt(rms, out=rms)
+        self._read = written
+        return True
@@ -0,0 +1,142 @@
+# timing for the render loop, to find out where the time goes when the audio glitches. every block records how long
+# each stage took, how long the whole block took against its deadline, and how many voices were playing. when it isn't
+# turned on nothing is timed at all (the render code only checks whether it has a RenderStats).
+#
+# the render thread only ever records a block. working out the percentiles and printing or writing them out is done
+# by a logging thread of its own (see start), so none of that lands on the render thread's deadline.
+
+import json
+import threading
+import time
+
+import numpy as np
+
+# the stages of a block, in the order they happen
+stages = ("events", "modulation", "oscillators", "envelopes", "mixing", "effects", "convert", "write")
+
+
+class RenderStats:
+    # history is how many blocks the percentiles are worked out over. with log_interval (seconds) it reports the
+    # stats that often once it's started, into log_path as json if it's given, or printed otherwise.
+    def __init__(self, sample_rate=44100, history=1024, log_interval=None, log_path=None):
+        self.sample_rate = sample_rate
+        self.history = history
+        self.log_interval = log_interval
+        self.log_path = log_path
+        self._stage_index = {stage: i for i, stage in enumerate(stages)}
+
+        # rolling history, one row per block
+        self.block_times = np.zeros(history)
+        self.stage_times = np.zeros((history, len(stages)))
+        self.voice_counts = np.zeros(history, dtype=int)
+        self._row = 0
+
+        self.blocks = 0
+        # blocks that took longer to render than they last for
+        self.deadline_misses = 0
+        # the ring buffer, so its underruns can be reported too, and the latency (in seconds) it's playing at
+        self.ring = None
+        self.latency = None
+
+        self._current = [0.0] * len(stages)
+        self._block_start = 0.0
+        self._last = 0.0
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start_block(self):
+        self._current = [0.0] * len(stages)
+        self._block_start = self._last = time.perf_counter()
+
+    # adds the time since the last mark to stage. a stage can be marked more than once in a block.
+    def mark(self, stage):
+        now = time.perf_counter()
+        self._current[self._stage_index[stage]] += now - self._last
+        self._last = now
+
+    def end_block(self, num_frames, voices):
+        now = time.perf_counter()
+        block_time = now - self._block_start
+        row = self._row
+        self.block_times[row] = block_time
+        self.stage_times[row] = self._current
+        self.voice_counts[row] = voices
+        self._row = (row + 1) % self.history
+        self.blocks += 1
+        if block_time > num_frames / self.sample_rate:
+            self.deadline_misses += 1
+
+    # starts logging every log_interval seconds on a thread of its own (if there's a log_interval).
+    def start(self):
+        if self.log_interval is not None and self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.wait(self.log_interval):
+            self.log()
+
+    @property
+    def underruns(self):
+        return self.ring.underruns if self.ring is not None else 0
+
+    @staticmethod
+    def _summary(times):
+        if not len(times):
+            return {"p50": 0.0, "p99": 0.0, "max": 0.0}
+        p50, p99 = np.percentile(times, [50, 99])
+        return {"p50": p50 * 1000, "p99": p99 * 1000, "max": times.max() * 1000}
+
+    # everything so far as a dict. the times are in milliseconds per block.
+    #
+    # it can be called from another thread (the gui's, say) while the render thread is still going, so the counts and
+    # the history are copied once up front and only those copies are used. the render thread may have moved on by a
+    # block or so in between, which only makes a row more or less up to date.
+    def snapshot(self):
+        row = self._row
+        blocks = self.blocks
+        block_times = self.block_times.copy()
+        stage_times = self.stage_times.copy()
+        voice_counts = self.voice_counts.copy()
+        filled = min(blocks, self.history)
+        voices = voice_counts[:filled]
+        snapshot = {
+            "blocks": blocks,
+            "deadline_misses": self.deadline_misses,
+            "underruns": self.underruns,
+            "block_ms": self._summary(block_times[:filled]),
+            "stage_ms": {stage: self._summary(stage_times[:filled, i]) for i, stage in enumerate(stages)},
+            "voices": {
+                "current": int(voice_counts[(row - 1) % self.history]) if filled else 0,
+                "mean": float(voices.mean()) if filled else 0.0,
+                "max": int(voices.max()) if filled else 0,
+            },
+        }
+        if self.latency is not None:
+            snapshot["latency_ms"] = self.latency * 1000
+        return snapshot
+
+    def dump(self, path):
+        with open(path, "w") as stats_file:
+            json.dump(self.snapshot(), stats_file, indent=2)
+
+    def log(self):
+        if self.log_path is not None:
+            self.dump(self.log_path)
+            return
+        snapshot = self.snapshot()
+        block_ms = snapshot["block_ms"]
+        line = "blocks: {} p50: {:.2f}ms p99: {:.2f}ms max: {:.2f}ms deadline misses: {} underruns: {} voices: {}".format(
+            snapshot["blocks"], block_ms["p50"], block_ms["p99"], block_ms["max"], snapshot["deadline_misses"],
+            snapshot["underruns"], snapshot["voices"]["current"])
+        if "latency_ms" in snapshot:
+            line += " latency: {:.1f}ms".format(snapshot["latency_ms"])
+        print(line)
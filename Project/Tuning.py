@@ -0,0 +1,107 @@
+# tuning tables: the frequency of every MIDI note, and how far its phase moves each sample, worked out once as numpy
+# arrays so the voice bank can look up every voice's pitch in one go. a tuning is either equal temperament from any
+# reference pitch, or a scale loaded from a Scala .scl file (https://www.huygens-fokker.org/scala/scl_format.html).
+#
+# which key plays which note isn't part of the tuning, that's notes.key_notes.
+
+import os
+
+import numpy as np
+
+# the notes are MIDI note numbers, 0 to num_notes - 1
+num_notes = 128
+# A4, the note the reference pitch is normally given for
+a4 = 69
+# middle C (C4), where a Scala scale starts unless it's told otherwise
+middle_c = 60
+
+
+# the frequency of every note in equal temperament, with reference_note at reference Hz and divisions notes to an
+# octave.
+def equal_temperament(reference=440.0, reference_note=a4, divisions=12):
+    return reference * np.exp2((np.arange(num_notes) - reference_note) / divisions)
+
+
+# reads the pitches out of the text of a Scala file, as ratios from the first note of the scale. the first note (1/1)
+# isn't listed, and the last pitch is the interval the scale repeats at (usually 2/1, the octave).
+def parse_scala(text):
+    # lines starting with ! are comments. the first line left is the description, which can be blank.
+    lines = [line.strip() for line in text.splitlines() if not line.lstrip().startswith("!")]
+    if len(lines) < 2:
+        raise ValueError("not a scala file: it needs a description and a number of notes")
+    try:
+        count = int(lines[1].split()[0])
+    except (IndexError, ValueError):
+        raise ValueError("not a scala file: bad number of notes " + repr(lines[1]))
+    pitches = [line for line in lines[2:] if line][:count]
+    if count < 1 or len(pitches) != count:
+        raise ValueError("scala file says it has {} notes but has {}".format(count, len(pitches)))
+
+    ratios = []
+    for pitch in pitches:
+        # anything after the value is a label, and ignored
+        value = pitch.split()[0]
+        try:
+            if "." in value:
+                # cents
+                ratio = 2 ** (float(value) / 1200)
+            elif "/" in value:
+                numerator, denominator = value.split("/")
+                ratio = int(numerator) / int(denominator)
+            else:
+                ratio = int(value)
+        except (ValueError, ZeroDivisionError):
+            raise ValueError("bad pitch in scala file " + repr(pitch))
+        if ratio <= 0:
+            raise ValueError("bad pitch in scala file " + repr(pitch))
+        ratios.append(ratio)
+    return ratios
+
+
+class Tuning:
+    def __init__(self, freqs, sample_rate=44100, name="custom"):
+        self.freqs = np.array(freqs, dtype=float)
+        if self.freqs.shape != (num_notes,):
+            raise ValueError("a tuning needs a frequency for each of the {} notes".format(num_notes))
+        self.sample_rate = sample_rate
+        self.name = name
+        # how far (in radians) each note's phase moves every sample
+        self.steps = self.freqs * (2 * np.pi / sample_rate)
+
+    def __repr__(self):
+        return "Tuning({!r}, sample_rate={})".format(self.name, self.sample_rate)
+
+    # the frequency of one note
+    def freq(self, note):
+        return float(self.freqs[note])
+
+    # the same tuning, for rendering at another sample rate.
+    def at_sample_rate(self, sample_rate):
+        if sample_rate == self.sample_rate:
+            return self
+        return Tuning(self.freqs, sample_rate=sample_rate, name=self.name)
+
+    @classmethod
+    def equal(cls, reference=440.0, reference_note=a4, divisions=12, sample_rate=44100):
+        name = "{}-tet, {} = {:g}Hz".format(divisions, reference_note, reference)
+        return cls(equal_temperament(reference, reference_note, divisions), sample_rate=sample_rate, name=name)
+
+    # a scale given as ratios (like parse_scala gives), repeated up and down the notes. base_note plays the first
+    # note of the scale at base_freq, which defaults to its frequency in standard 440Hz equal temperament.
+    @classmethod
+    def from_ratios(cls, ratios, base_note=middle_c, base_freq=None, sample_rate=44100, name="custom"):
+        if base_freq is None:
+            base_freq = equal_temperament()[base_note]
+        ratios = np.asarray(ratios, dtype=float)
+        degrees = np.concatenate([[1.0], ratios[:-1]])
+        period = ratios[-1]
+        octaves, degree = np.divmod(np.arange(num_notes) - base_note, len(degrees))
+        freqs = base_freq * period ** octaves.astype(float) * degrees[degree]
+        return cls(freqs, sample_rate=sample_rate, name=name)
+
+    @classmethod
+    def from_scala(cls, path, base_note=middle_c, base_freq=None, sample_rate=44100):
+        with open(path) as scala_file:
+            ratios = parse_scala(scala_file.read())
+        name = os.path.splitext(os.path.basename(path))[0]
+        return cls.from_ratios(ratios, base_note=base_note, base_freq=base_freq, sample_rate=sample_rate, name=name)
@@ -0,0 +1,520 @@
+import numpy as np
+
+from .Generators import Interpolator, adsr_level, control_points
+from .Tuning import Tuning
+from .Wavetables import get_wavetables
+
+# the ways the bank can pick which voice to replace when every voice is already playing.
+#   oldest: the voice that started first
+#   quietest: the voice with the lowest current level
+#   released: a voice whose key has been let go (the quietest of them), otherwise the oldest
+steal_policies = ("oldest", "quietest", "released")
+
+
+# the release_t of a voice that hasn't been released. it's finite (rather than inf) so the envelope math never makes a
+# nan, and still fits in a float32.
+never = 1e30
+
+# the per voice values kept as rows of one float64 array, so a voice can be moved with one copy and the whole lot
+# converted to the render dtype with another. the rates and ends are worked out from the envelope lengths when a note
+# starts or is released, so rendering only has to multiply.
+_fields = ("phase", "amp", "t", "attack", "decay", "sustain", "release", "release_t", "release_val", "level",
+           "attack_rate", "decay_end", "decay_rate", "release_rate", "release_end")
+
+
+# the times the envelope changes from one straight line to the next
+_corner_fields = ("attack", "decay_end", "release_t", "release_end")
+
+
+# all the voices of the synth, kept as one set of numpy arrays (one slot per voice) instead of an oscillator object
+# per note. the playing voices are always packed into the first `count` slots, so every voice can be rendered at
+# once as a (voices, frames) array and mixed with a single sum.
+#
+# voices play MIDI note numbers, and get their frequencies from the tuning (see Tuning) every block, all at once.
+# changing the tuning retunes the notes that are already playing.
+#
+# rendering doesn't allocate: every array it works in is made once, for the biggest block it has been asked for, and
+# written in place after that. that includes numpy's own scratch space: a ufunc that has to broadcast one of its
+# inputs (a per voice column against a block, say) buffers it through a temporary of its own on every call, so the
+# per voice values and the ramp are copied out to the full shape of the block first (np.copyto doesn't need one), and
+# every ufunc in the render only ever sees contiguous arrays of the same shape and dtype. with dtype=np.float32 the
+# blocks are rendered in single precision (the per voice state stays in float64, so long notes don't drift).
+#
+# with a control_interval the envelopes run at a control rate: they're only worked out every that many frames from the
+# start of each block, and drawn in between with straight lines (see Generators.control_points). the oscillators are
+# still rendered every frame.
+#
+# with unison, every voice is that many copies of its oscillator (a supersaw, with the saw), detuned up to detune cents
+# either side of the note and started at random phases. the copies are rows of the same block as the voices, so
+# they're rendered together in one go, and mixed down with one matrix product that also pans them: spread is how far
+# across the stereo field they go (0 is all in the middle, 1 is the outermost copies hard left and right). with
+# channels=2 the mix comes back as (frames, 2), left and right interleaved like the output wants them.
+class VoiceBank:
+    def __init__(self, max_voices=32, sample_rate=44100, steal_policy="oldest", wavetables=None, dtype=np.float64,
+                 tuning=None, control_interval=1, unison=1, detune=15.0, spread=1.0, channels=1):
+        if steal_policy not in steal_policies:
+            raise ValueError("steal_policy must be one of " + ", ".join(steal_policies))
+        self.max_voices = max_voices
+        self.sample_rate = sample_rate
+        self.steal_policy = steal_policy
+        self.wavetables = wavetables if wavetables is not None else get_wavetables(sample_rate)
+        self.set_tuning(tuning if tuning is not None else Tuning.equal(sample_rate=sample_rate))
+        self.dtype = np.dtype(dtype)
+        self.control_interval = control_interval
+        self.unison = unison
+        self.channels = channels
+        # a Stats.RenderStats to time the stages of render with, if it's being timed
+        self.stats = None
+        # how many voices are playing
+        self.count = 0
+        # counts up with every note on, so the oldest voice has the smallest number
+        self._note_ons = 0
+
+        # whatever the note was started with (the key that was pressed), so it can be released later
+        self.keys = [None] * max_voices
+        self._state = np.zeros((len(_fields), max_voices))
+        for row, field in enumerate(_fields):
+            setattr(self, field, self._state[row])
+        # the oscillator is note, phase (in radians) and amp. the envelope is the rest, with the lengths in samples
+        # and t counting the samples since the note started. level is the envelope at the end of the last block.
+        self.release_t[:] = never
+        self.release_end[:] = never
+        self.note = np.zeros(max_voices, dtype=np.intp)
+        self.wave_shape = np.zeros(max_voices, dtype=np.intp)
+        self.released = np.zeros(max_voices, dtype=bool)
+        self.started = np.zeros(max_voices, dtype=np.int64)
+
+        self._arrays = [self._state, self.note, self.wave_shape, self.released, self.started]
+        # every unison copy's phase, which it keeps to itself since they all run at different frequencies. (with one
+        # copy it's just phase.)
+        self.unison_phase = np.zeros((unison, max_voices))
+        self._arrays.append(self.unison_phase)
+        self._rng = np.random.default_rng()
+        self._random = np.zeros(unison)
+        self.set_unison(detune, spread)
+        # scratch for picking a voice to steal
+        self._loudness = np.zeros(max_voices)
+        self._held_down = np.zeros(max_voices, dtype=bool)
+        self._block_size = 0
+        self._allocate(256)
+
+    # how each unison copy is tuned and panned. the gains keep the copies about as loud together as one copy on its
+    # own (they're at random phases, so they add up by power rather than by amplitude), and pan them with an equal
+    # power curve. one copy in mono doesn't need any of it. both are kept once for every voice, so the render
+    # doesn't have to broadcast them.
+    def set_unison(self, detune=15.0, spread=1.0):
+        unison, channels = self.unison, self.channels
+        self.detune = detune
+        self.spread = spread
+        if unison > 1:
+            self._detune = 2 ** (np.linspace(-detune, detune, unison) / 1200)
+            pans = np.linspace(-spread, spread, unison)
+        else:
+            self._detune = np.ones(1)
+            pans = np.zeros(1)
+        if channels == 1:
+            gains = np.ones((unison, 1))
+        elif channels == 2:
+            angles = (pans + 1) * np.pi / 4
+            gains = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+        else:
+            raise ValueError("channels must be 1 or 2")
+        gains /= np.sqrt(unison)
+        self._detune = np.tile(self._detune, (self.max_voices, 1))
+        self._gains = None if unison == 1 and channels == 1 else np.tile(gains.astype(self.dtype),
+                                                                        (self.max_voices, 1, 1))
+
+    # makes the scratch space for rendering blocks of up to block_size frames.
+    def _allocate(self, block_size):
+        voices, dtype = self.max_voices, self.dtype
+        # every unison copy is a row of its own in the oscillator blocks
+        rows = voices * self.unison
+        # the (voices, frames) ones are kept flat, so a block of any length can be viewed as a contiguous array.
+        shape = voices * block_size
+        row_shape = rows * block_size
+        # the per voice values in the render dtype, refreshed every block
+        self._params = np.zeros((len(_fields), voices), dtype=dtype)
+        self._steps = np.zeros(voices)
+        self._block_steps = np.zeros((rows, 1), dtype=dtype)
+        self._ends = np.zeros(rows)
+        self._offsets = np.zeros(voices, dtype=np.intp)
+        self._ended = np.zeros(voices, dtype=bool)
+        self._ramp = np.arange(block_size, dtype=dtype)
+        self._vals = np.zeros(row_shape, dtype=dtype)
+        self._env = np.zeros(shape, dtype=dtype)
+        self._tmp = np.zeros(row_shape, dtype=dtype)
+        # the per voice values copied out to the shape of the block (see the class comment)
+        self._column = np.zeros(row_shape, dtype=dtype)
+        self._block_offsets = np.zeros(row_shape, dtype=np.intp)
+        self._times = np.zeros(shape, dtype=dtype)
+        self._index = np.zeros(row_shape, dtype=np.intp)
+        self._samples = np.zeros(row_shape, dtype=np.complex64 if dtype == np.float32 else complex)
+        self._mask = np.zeros(shape, dtype=bool)
+        self._mask2 = np.zeros(shape, dtype=bool)
+        self._zero = np.zeros((), dtype=dtype)
+        self._mix = np.zeros(block_size if self.channels == 1 else (block_size, self.channels), dtype=dtype)
+        # the unison copies' steps, starting phases and table offsets, and what every copy is mixed into each
+        # channel with
+        self._row_steps = np.zeros(rows)
+        self._row_phase = np.zeros(rows, dtype=dtype)
+        self._row_offsets = np.zeros(rows, dtype=np.intp)
+        self._weights = np.zeros(rows * self.channels, dtype=dtype)
+        # the envelopes' points, when they run at a control rate
+        interval = self.control_interval
+        if interval > 1:
+            points = voices * control_points(block_size, interval)
+            self._ctl_ramp = np.arange(control_points(block_size, interval), dtype=dtype) * interval
+            self._ctl_env = np.zeros(points, dtype=dtype)
+            self._interpolator = Interpolator(interval, dtype=dtype)
+            self._ctl_tmp = np.zeros(points, dtype=dtype)
+            self._ctl_column = np.zeros(points, dtype=dtype)
+            self._ctl_times = np.zeros(points, dtype=dtype)
+            self._ctl_mask = np.zeros(points, dtype=bool)
+            self._ctl_mask2 = np.zeros(points, dtype=bool)
+            # where each voice's corners are in the block, and which of them land inside it
+            self._corners = np.zeros((len(_corner_fields), voices, 1), dtype=dtype)
+            self._distance = np.zeros((len(_corner_fields), voices, 1), dtype=dtype)
+            self._inside = np.zeros((len(_corner_fields), voices, 1), dtype=bool)
+        self._block_size = block_size
+
+    # a contiguous (n, num_frames) view of one of the flat scratch arrays.
+    @staticmethod
+    def _view(buffer, n, num_frames):
+        return buffer[:n * num_frames].reshape(n, num_frames)
+
+    # makes sure blocks of block_size frames can be rendered without allocating.
+    def prepare(self, block_size):
+        if block_size > self._block_size:
+            self._allocate(block_size)
+
+    def __len__(self):
+        return self.count
+
+    # the slot of the voice playing key that hasn't been released yet, or -1. a key only ever holds one voice, since
+    # note_on won't start another.
+    def _held(self, key):
+        keys, released = self.keys, self.released
+        for i in range(self.count):
+            if keys[i] == key and not released[i]:
+                return i
+        return -1
+
+    # picks a slot to reuse when the bank is full. it works in its own scratch, so stealing doesn't allocate either.
+    def _steal(self):
+        n = self.count
+        if self.steal_policy == "oldest" or (self.steal_policy == "released" and not self.released[:n].any()):
+            return int(np.argmin(self.started[:n]))
+        loudness = self._loudness[:n]
+        np.multiply(self.level[:n], self.amp[:n], out=loudness)
+        if self.steal_policy == "released":
+            # only the released voices can go
+            held_down = self._held_down[:n]
+            np.logical_not(self.released[:n], out=held_down)
+            np.copyto(loudness, np.inf, where=held_down)
+        return int(np.argmin(loudness))
+
+    def set_tuning(self, tuning):
+        self.tuning = tuning.at_sample_rate(self.sample_rate)
+
+    # the frequency each playing voice is at, before any modulation.
+    @property
+    def freqs(self):
+        return self.tuning.freqs[self.note[:self.count]]
+
+    # starts a voice on a MIDI note. the envelope durations are in seconds. nothing happens if key is already being
+    # held. the slot is written over in place, so starting a note doesn't allocate anything. it returns the slot the
+    # voice went in, or None.
+    def note_on(self, key, note, amp=0.2, wave_shape=0, attack=0.05, decay=0.2, sustain=0.7, release=0.3):
+        if self._held(key) >= 0:
+            return None
+        if self.count < self.max_voices:
+            i = self.count
+            self.count += 1
+        else:
+            i = self._steal()
+
+        sr = self.sample_rate
+        attack, decay = attack * sr, decay * sr
+        self.keys[i] = key
+        self.note[i] = note
+        self.phase[i] = 0
+        self.amp[i] = amp
+        self.wave_shape[i] = wave_shape
+        self.t[i] = 0
+        self.attack[i] = attack
+        self.decay[i] = decay
+        self.sustain[i] = sustain
+        self.release[i] = release * sr
+        self.release_t[i] = never
+        self.release_val[i] = 0
+        self.level[i] = 0
+        self.attack_rate[i] = 1 / attack if attack > 0 else 0
+        self.decay_end[i] = attack + decay
+        self.decay_rate[i] = (1 - sustain) / decay if decay > 0 else 0
+        self.release_rate[i] = 0
+        self.release_end[i] = never
+        self.released[i] = False
+        self.started[i] = self._note_ons
+        self._note_ons += 1
+        if self.unison > 1:
+            # the copies start at random phases, so they don't all line up into one loud spike at the start
+            self._rng.random(out=self._random)
+            self._random *= 2 * np.pi
+            self.unison_phase[:, i] = self._random
+        return i
+
+    # starts the release of the voice held by key, and returns its slot (or None if key isn't held). delay is how many
+    # frames into the next block it happens.
+    def note_off(self, key, delay=0):
+        i = self._held(key)
+        if i < 0:
+            return None
+        release_t = float(self.t[i]) + delay
+        release = float(self.release[i])
+        release_val = adsr_level(release_t, float(self.attack[i]), float(self.decay[i]), float(self.sustain[i]))
+        self.release_t[i] = release_t
+        self.release_val[i] = release_val
+        self.release_rate[i] = release_val / release if release > 0 else 0
+        self.release_end[i] = release_t + release
+        self.released[i] = True
+        return i
+
+    def change_wave_shape(self, wave_shape):
+        self.wave_shape[:self.count] = wave_shape
+
+    # moves the voice in slot src to slot dst.
+    def _move(self, src, dst):
+        for array in self._arrays:
+            array[..., dst] = array[..., src]
+        self.keys[dst] = self.keys[src]
+
+    # removes every voice that has finished its release, keeping the playing voices packed at the front.
+    def _free_ended(self):
+        n = self.count
+        ended = self._ended[:n]
+        np.greater_equal(self.t[:n], self.release_end[:n], out=ended)
+        if not ended.any():
+            return
+        ended = np.flatnonzero(ended)
+        # go backwards so that the voice moved into a freed slot has already been checked.
+        for i in ended[::-1]:
+            last = self.count - 1
+            if i != last:
+                self._move(last, i)
+            self.keys[last] = None
+            self.count = last
+
+    # renders and mixes every voice for the next num_frames frames, into out if it's given ((num_frames, channels) in
+    # stereo). amp_mod multiplies the mix and freq_mod multiplies every voice's frequency, one value per frame (or None). the
+    # mix that comes back is reused by the next render, so it has to be copied to be kept.
+    def render(self, num_frames, amp_mod=None, freq_mod=None, out=None):
+        self.prepare(num_frames)
+        mix = self._mix[:num_frames] if out is None else out
+        n = self.count
+        if n == 0:
+            mix.fill(0)
+            return mix
+        ramp = self._ramp[:num_frames]
+        params = self._params[:, :n]
+        np.copyto(params, self._state[:, :n], casting="same_kind")
+        p = dict(zip(_fields, params[:, :, None]))
+        unison = self.unison
+        rows = n * unison
+        phases = self._view(self._vals, rows, num_frames)
+        tmp = self._view(self._tmp, rows, num_frames)
+        column = self._view(self._column, rows, num_frames)
+
+        # the phase of every voice (every unison copy of it) for every frame
+        steps = self._steps[:n]
+        ends = self._ends[:rows]
+        notes = self.note[:n]
+        np.take(self.tuning.steps, notes, out=steps)
+        if unison > 1:
+            row_steps = self._row_steps[:rows]
+            voice_steps = row_steps.reshape(n, unison)
+            np.copyto(voice_steps, steps[:, None])
+            voice_steps *= self._detune[:n]
+            start = self._row_phase[:rows]
+            np.copyto(start.reshape(n, unison), self.unison_phase[:, :n].T, casting="same_kind")
+            start = start[:, None]
+        else:
+            row_steps = steps
+            start = p["phase"]
+        block_steps = self._block_steps[:rows]
+        np.copyto(block_steps[:, 0], row_steps)
+        np.copyto(column, block_steps)
+        if freq_mod is None:
+            np.copyto(phases, ramp)
+            phases *= column
+            np.multiply(row_steps, num_frames, out=ends)
+        else:
+            # the step changes every frame, so the phase is the running sum of the steps.
+            np.copyto(tmp, freq_mod)
+            tmp *= column
+            np.cumsum(tmp, axis=1, out=phases)
+            np.copyto(ends, phases[:, -1])
+            phases -= tmp
+        np.copyto(column, start)
+        phases += column
+        if unison > 1:
+            row_ends = ends.reshape(n, unison)
+            row_ends += self.unison_phase[:, :n].T
+        else:
+            ends += self.phase[:n]
+
+        vals = self._oscillate(phases, freq_mod, p, tmp, column)
+        stats = self.stats
+        if stats is not None:
+            stats.mark("oscillators")
+
+        env = self._view(self._env, n, num_frames)
+        self._render_envelope(env, p, self._view(self._tmp, n, num_frames), self._view(self._column, n, num_frames))
+        gains = self._gains
+        if gains is None:
+            vals *= env
+            np.copyto(tmp, p["amp"])
+            vals *= tmp
+            if stats is not None:
+                stats.mark("envelopes")
+            np.sum(vals, axis=0, out=mix)
+        else:
+            # every copy of a voice gets its envelope, and the mix down is one matrix product of the copies with
+            # their gains for each channel, scaled by their voice's amp.
+            np.copyto(tmp.reshape(n, unison, num_frames), env[:, None, :])
+            vals *= tmp
+            if stats is not None:
+                stats.mark("envelopes")
+            channels = self.channels
+            weights = self._view(self._weights, rows, channels)
+            voice_weights = weights.reshape(n, unison, channels)
+            np.copyto(voice_weights, params[_fields.index("amp"), :, None, None])
+            voice_weights *= gains[:n]
+            if channels == 1:
+                np.matmul(weights[:, 0], vals, out=mix)
+            else:
+                np.matmul(vals.T, weights, out=mix)
+        if amp_mod is not None:
+            if mix.ndim == 1:
+                mix *= amp_mod
+            else:
+                gain = self._view(self._tmp, num_frames, self.channels)
+                np.copyto(gain, amp_mod[:, None])
+                mix *= gain
+        if stats is not None:
+            stats.mark("mixing")
+
+        if unison > 1:
+            # (the voice's own phase isn't used with unison)
+            np.remainder(ends.reshape(n, unison).T, 2 * np.pi, out=self.unison_phase[:, :n])
+        else:
+            np.remainder(ends, 2 * np.pi, out=self.phase[:n])
+        self.t[:n] += num_frames
+        np.copyto(self.level[:n], env[:, -1])
+        self._free_ended()
+        return mix
+
+    # turns the phases of every voice (a (voices, frames) block, with a row for every unison copy) into samples, in
+    # place. every voice reads from the table for its own wave shape and octave, and so do its copies.
+    def _oscillate(self, phases, freq_mod, p, tmp, column):
+        rows, num_frames = phases.shape
+        n = self.count
+        steps = self._steps[:n]
+        offsets = self._offsets[:n]
+        np.take(self.tuning.freqs, self.note[:n], out=steps)
+        if freq_mod is not None:
+            steps *= freq_mod.max()
+        self.wavetables.offsets_into(self.wave_shape[:n], steps, offsets, steps)
+        if rows > n:
+            row_offsets = self._row_offsets[:rows]
+            np.copyto(row_offsets.reshape(n, self.unison), offsets[:, None])
+            offsets = row_offsets
+        # (the table reads add the offsets to the whole block, so they're given to it at its full shape)
+        block_offsets = self._view(self._block_offsets, rows, num_frames)
+        np.copyto(block_offsets, offsets[:, None])
+        return self.wavetables.read_into(block_offsets, phases, phases, tmp, self._view(self._index, rows, num_frames),
+                                         self._view(self._samples, rows, num_frames))
+
+    # works out the envelope for the block into env, either every frame or at the control rate and drawn in. p is
+    # the block's per voice values as columns (see _envelope), and tmp and column are scratch the same shape as env.
+    def _render_envelope(self, env, p, tmp, column):
+        n, num_frames = env.shape
+        interval = self.control_interval
+        if interval > 1:
+            size = control_points(num_frames, interval)
+            points = self._view(self._ctl_env, n, size)
+            self._envelope(points, p, self._ctl_ramp[:size], self._view(self._ctl_tmp, n, size),
+                           self._view(self._ctl_column, n, size), self._view(self._ctl_times, n, size),
+                           self._view(self._ctl_mask, n, size), self._view(self._ctl_mask2, n, size))
+            self._interpolator.into(points, env)
+            self._exact_corners(env, p, tmp, column)
+        else:
+            self._envelope(env, p, self._ramp[:num_frames], tmp, column, self._view(self._times, n, num_frames),
+                           self._view(self._mask, n, num_frames), self._view(self._mask2, n, num_frames))
+        return env
+
+    # the envelope is straight lines between its corners (the end of the attack and the decay, and the start and end of
+    # the release), so drawing it in from the points is exact except in the intervals a corner falls inside, where it
+    # would cut the corner off (by up to interval / (4 * attack) with a short attack). those intervals are worked out
+    # again every frame. a corner only comes round once a note, so there's rarely more than a few of them in a block.
+    def _exact_corners(self, env, p, tmp, column):
+        n, num_frames = env.shape
+        interval = self.control_interval
+        corners = self._corners[:, :n]
+        distance = self._distance[:, :n]
+        inside = self._inside[:, :n]
+        for k, field in enumerate(_corner_fields):
+            np.subtract(p[field], p["t"], out=corners[k])
+        # strictly inside the block: less than half the block from its middle
+        half = num_frames / 2
+        np.subtract(corners, half, out=distance)
+        np.abs(distance, out=distance)
+        np.less(distance, half, out=inside)
+        if not inside.any():
+            return
+        for k, i, _ in zip(*np.nonzero(inside)):
+            corner = corners[k, i, 0]
+            if corner % interval:
+                start = int(corner // interval) * interval
+                frames = min(interval, num_frames - start)
+                row = {name: value[i:i + 1] if np.ndim(value) == 2 else value for name, value in p.items()}
+                self._envelope(env[i:i + 1, start:start + frames], row, self._ramp[start:start + frames],
+                               tmp[:1, :frames], column[:1, :frames], self._view(self._times, 1, frames),
+                               self._view(self._mask, 1, frames), self._view(self._mask2, 1, frames))
+
+    # the same curve as Generators.adsr_curve, worked out in place into env. p is the block's per voice values as
+    # columns, and the rest is scratch space. every column is copied out to the shape of env (into column) before it's
+    # used, so that numpy doesn't have to broadcast it.
+    def _envelope(self, env, p, ramp, tmp, column, times, mask, mask2):
+        np.copyto(times, ramp)
+        np.copyto(column, p["t"])
+        times += column
+        np.copyto(env, p["sustain"])
+        # decay goes from 1 down to the sustain level
+        np.copyto(column, p["attack"])
+        np.subtract(times, column, out=tmp)
+        np.greater_equal(times, column, out=mask)
+        np.copyto(column, p["decay_rate"])
+        tmp *= column
+        np.subtract(1, tmp, out=tmp)
+        np.copyto(column, p["decay_end"])
+        np.less(times, column, out=mask2)
+        mask &= mask2
+        np.copyto(env, tmp, where=mask)
+        # attack goes from 0 up to 1
+        np.copyto(column, p["attack"])
+        np.less(times, column, out=mask)
+        np.copyto(column, p["attack_rate"])
+        np.multiply(times, column, out=tmp)
+        np.copyto(env, tmp, where=mask)
+        # release goes from release_val down to 0, and stays there
+        np.copyto(column, p["release_t"])
+        np.subtract(times, column, out=tmp)
+        np.greater_equal(times, column, out=mask)
+        np.copyto(column, p["release_rate"])
+        tmp *= column
+        np.copyto(column, p["release_val"])
+        np.subtract(column, tmp, out=tmp)
+        np.copyto(env, tmp, where=mask)
+        np.copyto(column, p["release_end"])
+        np.greater_equal(times, column, out=mask)
+        np.copyto(env, self._zero, where=mask)
@@ -0,0 +1,141 @@
+import math
+
+import numpy as np
+
+# how many samples each table has for one cycle of the wave. it has to be a power of two.
+table_size = 2048
+# the lowest frequency the tables are built for. every table covers one octave, starting from here.
+lowest_freq = 20.0
+
+
+# the sine coefficients and cosine coefficients of harmonics 0 to num_harmonics of each wave shape. they are
+# worked out to match the shapes in Generators, so a table lines up with the naive wave it replaces.
+def _harmonics(wave_shape, num_harmonics):
+    k = np.arange(num_harmonics + 1)
+    sin_coeffs = np.zeros(num_harmonics + 1)
+    cos_coeffs = np.zeros(num_harmonics + 1)
+    odd = (k % 2) == 1
+    if wave_shape == 0:  # sine
+        sin_coeffs[1] = 1
+    elif wave_shape == 1:  # square
+        sin_coeffs[odd] = 4 / (np.pi * k[odd])
+    elif wave_shape == 2:  # saw
+        sin_coeffs[1:] = (2 / np.pi) * np.where(odd[1:], 1, -1) / k[1:]
+    else:  # triangle
+        cos_coeffs[odd] = -8 / (np.pi ** 2 * k[odd] ** 2)
+    return sin_coeffs, cos_coeffs
+
+
+# one cycle of wave_shape containing no harmonics above num_harmonics, built with an inverse fft.
+def _band_limited_cycle(wave_shape, num_harmonics, size):
+    sin_coeffs, cos_coeffs = _harmonics(wave_shape, num_harmonics)
+    spectrum = np.zeros(size // 2 + 1, dtype=complex)
+    spectrum[:num_harmonics + 1] = (cos_coeffs - 1j * sin_coeffs) * (size / 2)
+    return np.fft.irfft(spectrum, n=size)
+
+
+# band limited tables for every wave shape, one per octave (a mipmap), so a note only ever gets read from a table
+# without any harmonics above the nyquist frequency. reading a table is cheaper than calling np.sin and doesn't
+# alias on the high notes like the naive square and saw do.
+class Wavetables:
+    def __init__(self, sample_rate=44100, size=table_size, lowest=lowest_freq, tables=None):
+        if size & (size - 1):
+            raise ValueError("the table size must be a power of two")
+        self.sample_rate = sample_rate
+        self.size = size
+        self.lowest = lowest
+        nyquist = sample_rate / 2
+        self.num_octaves = max(1, int(np.ceil(np.log2(nyquist / lowest))))
+        if tables is None:
+            tables = self._build()
+        # (wave shapes, octaves, size)
+        self.tables = tables
+        # the value of every sample, with the slope up to the next one as the imaginary part. that way both come out
+        # of a single lookup when interpolating.
+        slopes = np.roll(tables, -1, axis=2) - tables
+        self._lookup = (tables + 1j * slopes).reshape(-1)
+        # the same at single precision, for rendering in float32
+        self._lookup32 = self._lookup.astype(np.complex64)
+
+    def _build(self):
+        nyquist = self.sample_rate / 2
+        tables = np.zeros((4, self.num_octaves, self.size))
+        for octave in range(self.num_octaves):
+            # the highest note this table gets used for decides how many harmonics fit in.
+            top = self.lowest * 2 ** (octave + 1)
+            num_harmonics = int(min(max(nyquist // top, 1), self.size // 2 - 1))
+            for wave_shape in range(4):
+                tables[wave_shape, octave] = _band_limited_cycle(wave_shape, num_harmonics, self.size)
+        return tables
+
+    # which octave's table to use for freq (which can be an array).
+    def octave(self, freq):
+        octaves = np.floor(np.log2(np.maximum(np.abs(freq), 1e-9) / self.lowest))
+        return np.clip(octaves, 0, self.num_octaves - 1).astype(int)
+
+    # the row of self.tables (flattened over shapes and octaves) for each wave shape and frequency.
+    def rows(self, wave_shape, freq):
+        return np.asarray(wave_shape) * self.num_octaves + self.octave(freq)
+
+    # where the row for one wave shape and frequency starts in the lookup table, as a plain int.
+    def offset(self, wave_shape, freq):
+        octave = math.floor(math.log2(max(abs(freq), 1e-9) / self.lowest))
+        return (wave_shape * self.num_octaves + min(max(octave, 0), self.num_octaves - 1)) * self.size
+
+    # where each row from rows() starts in the lookup table, written into out (an int array) using tmp (a float
+    # array) so nothing gets allocated. this is what read_into() takes.
+    def offsets_into(self, wave_shape, freq, out, tmp):
+        np.abs(freq, out=tmp)
+        np.maximum(tmp, 1e-9, out=tmp)
+        tmp /= self.lowest
+        np.log2(tmp, out=tmp)
+        np.floor(tmp, out=tmp)
+        np.clip(tmp, 0, self.num_octaves - 1, out=tmp)
+        np.copyto(out, tmp, casting="unsafe")
+        np.multiply(wave_shape, self.num_octaves, out=tmp)
+        np.add(out, tmp, out=out, casting="unsafe")
+        out *= self.size
+        return out
+
+    # reads the tables at phases (in radians) with linear interpolation. rows is one row per phase, or one row per
+    # line of a 2d array of phases, as given by rows().
+    def read(self, rows, phases):
+        phases = np.asarray(phases, dtype=float)
+        return self.read_into(np.asarray(rows) * self.size, phases, np.empty_like(phases), np.empty_like(phases),
+                              np.empty(phases.shape, dtype=np.intp), np.empty(phases.shape, dtype=complex))
+
+    # read() without allocating anything, with the rows given as offsets (see offsets_into), one per row of phases or
+    # already the shape of phases (which saves numpy a buffer to broadcast them through). the result goes in out
+    # (which can be phases itself), and whole, index (an int array) and samples (a complex array) are scratch space
+    # the same shape as phases. complex64 samples read the float32 copy of the tables.
+    def read_into(self, offsets, phases, out, whole, index, samples):
+        np.multiply(phases, self.size / (2 * np.pi), out=out)
+        # split into the sample to read and how far it is to the next one. it's rounded down (not towards zero), so
+        # a negative phase (from phase modulation) still reads between the sample before it and the one after.
+        np.floor(out, out=whole)
+        np.copyto(index, whole, casting="unsafe")
+        out -= whole
+        # wrap into the cycle
+        np.bitwise_and(index, self.size - 1, out=index)
+        if np.ndim(offsets) == 1:
+            offsets = offsets[:, None]
+        index += offsets
+        lookup = self._lookup32 if samples.dtype == np.complex64 else self._lookup
+        np.take(lookup, index, out=samples, mode="wrap")
+        np.multiply(samples.imag, out, out=out)
+        out += samples.real
+        return out
+
+    # reads one wave shape at one frequency
+    def lookup(self, wave_shape, freq, phases):
+        return self.read(self.rows(wave_shape, freq), phases)
+
+
+_wavetables = {}
+
+
+# the tables for sample_rate, only built once (which takes a few milliseconds) and shared from then on.
+def get_wavetables(sample_rate=44100):
+    if sample_rate not in _wavetables:
+        _wavetables[sample_rate] = Wavetables(sample_rate)
+    return _wavetables[sample_rate]
@@ -0,0 +1,49 @@
+# the synth as a package. the engine (oscillators, envelopes, voices, effects and mixing) only needs numpy, and
+# nothing is imported until it's used: the names below are looked up in their module the first time they're asked for.
+# the front ends bring in their own libraries when they're started (the gui in main.make_gui, the sound card in
+# Output.PyAudioSink, the keyboard in main.Synthesizer.play and midi ports in Midi.backends), so none of them are
+# needed, or slow down, a plain import.
+#
+#   import Project
+#   engine = Project.SynthEngine()
+#
+# the modules import each other relative to the package, so it's one set of modules however it's used, and none of
+# their names (Engine, Stats, Output...) are taken over for the rest of the process. the scripts are run as modules
+# from the folder above this one:
+#
+#   python -m Project.main
+#   python -m Project.Offline events.json out.wav
+#   python -m Project.Benchmark --output bench.json
+
+import importlib
+
+# everything that's exported, and the module it's in
+_exports = {
+    "SynthEngine": "Engine",
+    "VoiceBank": "Voices",
+    "FMVoiceBank": "FM",
+    "Oscillator": "Generators",
+    "ModulatedOscillator": "Generators",
+    "ADSREnvelope": "Generators",
+    "VoicePool": "Generators",
+    "ModulationBus": "Generators",
+    "EffectsChain": "Effects",
+    "Tuning": "Tuning",
+    "EventQueue": "Events",
+    "ParamStore": "Params",
+    "MidiFilePlayer": "Midi",
+    "OfflineRenderer": "Offline",
+    "RingBuffer": "Output",
+    "WavRecorder": "Output",
+    "RenderStats": "Stats",
+    "ScopeTap": "Scope",
+}
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name not in _exports:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module("." + _exports[name], __name__), name)
+    globals()[name] = value
+    return value
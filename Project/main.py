@@ -1,93 +1,86 @@
-import math
-import time
-
-import pyaudio
-from Generators import *
-
-from notes import key_frequencies
-import keyboard
+from .Generators import *
+
+from .notes import key_notes
+from .Engine import SynthEngine, default_LFO
+from .Tuning import Tuning
+from .Output import RingBuffer, LatencyTuner, WavRecorder, sinks
+from .Events import EventQueue
+from .Params import ParamStore
+from .Midi import MidiFilePlayer, MidiInput, backends as midi_backends
+from .Stats import RenderStats
+from .Scope import ScopeTap
 import threading
-import App
+import time
+import numpy as np
 
 
 # sample rate must be low in order to allow complicated processes to take place smoothly.
 # sample_rate = 11025
-# you may need a fast computer to play multiple notes at once :/
-max_voices = 2
+# every voice is rendered at once by the voice bank, so this can be fairly high. when it is full the voice picked by
+# steal_policy (see Voices.steal_policies) is replaced.
+max_voices = 32
+steal_policy = "released"
 sample_rate = 44100
+# the LFOs and envelopes only change every this many frames, with straight lines drawn in between, which is most of
+# what let the sample rate come back up. 1 runs them every frame.
+control_interval = 32
+# how many frames are rendered at a time, and how many blocks are rendered ahead of what's playing. more blocks ahead
+# means fewer dropouts, but a longer wait between pressing a key and hearing it.
+block_size = 256
+blocks_ahead = 3
+# lets the synth pick its own block size and blocks ahead while it plays (see Output.LatencyTuner), starting from the
+# ones above: more when it's struggling to keep up, less when it has time to spare. it keeps what's waiting to be
+# heard between min_latency and max_latency seconds, in blocks of min_block_size to max_block_size frames. the sound
+# card's own buffer stays at block_size, since that can't change once it's open.
+adaptive_latency = False
+min_latency = 0.01
+max_latency = 0.1
+min_block_size = 64
+max_block_size = 2048
+# renders the voices on this many extra processes (0 renders them on the synth thread). it adds a block of latency, but
+# lets big chords use more than one core.
+render_processes = 0
+# what the blocks are rendered in. float32 is plenty for 16 bit output and moves half the memory.
+render_dtype = np.float32
+# the keys play MIDI notes (see notes.key_notes) in this tuning: a Scala .scl file if tuning_file is set, otherwise equal
+# temperament with A4 at reference_pitch.
+tuning_file = None
+reference_pitch = 440.0
+# a standard midi file to play along with the keyboard, if it's set.
+midi_file = None
+# a live midi input, from Midi.backends ("rtmidi" for a real port). midi_port picks which one by name or number,
+# otherwise a virtual port is opened that other programs can play into.
+midi_input = None
+midi_port = None
+# the effects on the mixed sound, in order, as (name, settings) from Effects.effect_types. for example
+# [("lowpass", {"cutoff": 2000}), ("delay", {"delay": 0.25}), ("reverb", {"room": 0.8})]
+effects = []
+# unison plays every note as that many copies, up to unison_detune cents either side of it (7 copies of the saw is a
+# supersaw). with stereo output they're spread across it, from the middle (0) out to hard left and right (1).
+unison = 1
+unison_detune = 15.0
+unison_spread = 1.0
+# 1 for mono output, 2 for stereo
+channels = 1
+# plays every note as an FM patch instead of the wave shapes: a preset from FM.presets (like "electric_piano" or
+# "bell"), or a list of operator settings (see FM.Operator).
+fm_operators = None
+# where the sound goes, from Output.sinks. "null" runs everything without a sound card, and "file" writes it into the
+# wav file at output_path instead.
+output_sink = "pyaudio"
+output_path = "output.wav"
+# records everything that's played into this wav file, if it's set (see Synthesizer.start_recording)
+record_path = None
+# shows an oscilloscope and level meters of what's being played in the gui
+show_scope = True
+# times every stage of the render loop (see Stats). with stats_log_interval it prints a summary every that many seconds.
+enable_stats = False
+stats_log_interval = None
 
 
 # def main():
 
 
-# code modified from https://python.plainenglish.io/making-a-synth-with-python-oscillators-2cb8e68e9c3b
-class Oscillator(VariableOscillator):
-    def _post_freq_set(self):
-        self._step = (2 * math.pi * self._f) / sample_rate
-        self._period = sample_rate / self._f
-
-    def _post_phase_set(self):
-        self._p = (self._p / 360) * 2 * math.pi
-
-    def _initialize_osc(self):
-        self._i = 0
-        self.wave_shape_to_func = [self._sine_iterator, self._square_iterator, self._saw_iterator,
-                                   self._triangle_iterator]
-        self.iterate = self.wave_shape_to_func[self._wave_shape]  # the default
-
-    def __next__(self):
-        return self.iterate()
-
-    # generates a sine wave
-    def _sine_iterator(self):
-        val = math.sin(self._i + self._p)
-        self._i = self._i + self._step
-        return val * self._a
-
-    # generates a bunch of frames all at once.
-    def sine_gen(self, num_frames):
-        stop = self._i + (num_frames * self._step)
-        # calculate all the _i values for the next num_frames
-        # indexes = np.arange(self._i, stop, self._step)
-        indexes = np.linspace(self._i, stop, num=num_frames, endpoint=False)
-        # update _i so that it starts where this has ended.
-        self._i = stop
-        vals = np.sin(indexes) * self._a
-        return vals
-
-    # generates a square wave
-    def _square_iterator(self):
-        val = math.sin(self._i + self._p)
-        self._i = self._i + self._step
-        # threshold the value to -1 or 1
-        if val < 0:
-            val = -1
-        else:
-            val = 1
-        return val * self._a
-
-    # generate a sawtooth wave
-    def _saw_iterator(self):
-        div = (self._i + self._p) / self._period
-        val = 2 * (div - math.floor(0.5 + div))
-        self._i = self._i + 1
-        return val * self._a
-
-    # generate a triangle wave
-    def _triangle_iterator(self):
-        div = (self._i + self._p) / self._period
-        val = 2 * (div - math.floor(0.5 + div))
-        val = (abs(val) - 0.5) * 2
-        self._i = self._i + 1
-        return val * self._a
-
-    # whenever the wave shape is changed it changes the function that __next__ calls.
-    def change_wave_shape(self, new_wave_shape):
-        self.iterate = self.wave_shape_to_func[new_wave_shape]
-
-
-
-
 # class WaveAdder:
 #     def __init__(self, *oscillators):
 #         self.oscillators = oscillators
@@ -110,140 +103,194 @@ class Oscillator(VariableOscillator):
 #     return init_freq * val / 12
 
 
-# the default frequency
-
-default_LFO = 1
-
 LFOs = [
-    Oscillator(freq=default_LFO),  # LFO1
-    Oscillator(freq=default_LFO),  # LFO2
-    Oscillator(freq=default_LFO)  # LFO3
+    Oscillator(freq=default_LFO, sample_rate=sample_rate),  # LFO1
+    Oscillator(freq=default_LFO, sample_rate=sample_rate),  # LFO2
+    Oscillator(freq=default_LFO, sample_rate=sample_rate)  # LFO3
 ]
 
-# a list of ints, indicating the idnex of the LFOs that are active.
+# a list of ints, indicating the idnex of the LFOs that are active when the synth starts (the gui changes them through
+# synth.params after that).
 current_amp_LFO = []
 current_pitch_LFO = []
 # current_phase_LFO = []
 
 
-class Synthesizer(threading.Thread):
-    def __init__(self):
+def load_tuning():
+    if tuning_file is not None:
+        return Tuning.from_scala(tuning_file, sample_rate=sample_rate)
+    return Tuning.equal(reference=reference_pitch, sample_rate=sample_rate)
+
+
+# plays the SynthEngine live, from the keyboard.
+class Synthesizer(SynthEngine, threading.Thread):
+    def __init__(self, sink=None):
         threading.Thread.__init__(self)
+        SynthEngine.__init__(self, sample_rate=sample_rate, max_voices=max_voices, steal_policy=steal_policy,
+                             lfos=LFOs, amp_lfos=current_amp_LFO, pitch_lfos=current_pitch_LFO,
+                             processes=render_processes, block_size=block_size, dtype=render_dtype,
+                             tuning=load_tuning(), effects=effects, control_interval=control_interval,
+                             operators=fm_operators, unison=unison, detune=unison_detune, spread=unison_spread,
+                             channels=channels)
         self.stopping = False
-        self.wave_shape = 0  # default waveshape of sine.
-        self.notes_dict = {}
-        # the total volume basically
-        self.amp = 0
-        self.setup_stream()
+        # key presses from the keyboard thread, applied by the render thread.
+        self.events = EventQueue()
+        # the gui's settings, which the render thread takes a snapshot of every block
+        self.use_params(ParamStore(self.param_values()))
+        if show_scope:
+            self.enable_scope(ScopeTap(channels=channels, dtype=render_dtype))
+        self.midi_player = MidiFilePlayer(midi_file) if midi_file is not None else None
+        # live midi goes onto the same queue as the keyboard
+        self.midi_input = MidiInput(self.events, midi_backends[midi_input](port=midi_port)) if midi_input else None
+        self.setup_stream(sink)
+        # an Output.WavRecorder every block is copied to, while recording
+        self.recorder = None
+        if enable_stats:
+            stats = RenderStats(sample_rate=sample_rate, log_interval=stats_log_interval)
+            stats.ring = self.ring
+            stats.latency = self.latency
+            self.enable_stats(stats)
 
     def run(self):
         self.play()
 
-    def get_samples(self, dictionary, num_samples=256, amp_scale=0.2, max_amp=0.8):
-        ## TODO: VECTORIZE THE BELOW LOOP.
-        # samples = []
-        # for _ in range(num_samples):
-        #     samples.append(
-        #         [next(osc[0]) * self.amp for _, osc in dictionary.items()]
-        #     )
-        samples = [osc[0].rend(num_samples) * self.amp for _, osc in dictionary.items()]
-        # sums up all the different sounds and reduces the volume
-        # samples = np.array(samples).sum(axis=1) * amp_scale
-        samples = sum(samples) * amp_scale
-        # clips the sound so that it doesn't burst your eardrums
-        samples = np.int16(samples.clip(-max_amp, max_amp) * 32767)
-        return samples # samples.reshape(num_samples, -1)
-
-    def change_shape(self, shape_index):
-        oscillators = [o[0] for k, o in self.notes_dict.items()]
-        for osc in oscillators:
-            osc.change_wave_shape(shape_index)
-        self.wave_shape = shape_index
-
-    def update_pitch(self, factor):
-        oscillators = [o[0] for k, o in self.notes_dict.items()]
-        for osc in oscillators:
-            # osc.change_freq(factor)
-            osc.freqScale = factor
-
-    def setup_stream(self):
-        self.stream = pyaudio.PyAudio().open(
-            rate=sample_rate,
-            channels=1,
-            format=pyaudio.paInt16,
-            output=True,
-            frames_per_buffer=256
-        )
+    # the sink pulls from the ring buffer whenever it needs audio, and this thread keeps the ring topped up to
+    # fill_target. the ring counts samples, which is channels to a frame.
+    def setup_stream(self, sink=None):
+        self.block_frames = block_size
+        self.block_samples = block_size * channels
+        self.fill_target = self.block_samples * blocks_ahead
+        capacity = self.fill_target
+        self.tuner = None
+        if adaptive_latency:
+            self.tuner = LatencyTuner(sample_rate=sample_rate, block_size=block_size, blocks_ahead=blocks_ahead,
+                                      min_latency=min_latency, max_latency=max_latency, min_block=min_block_size,
+                                      max_block=max_block_size)
+            # room for the most it can ever keep waiting, and buffers for the biggest block it can go to, so changing
+            # doesn't allocate anything.
+            capacity = max(capacity, int(max_latency * sample_rate) * channels)
+            self.prepare(max_block_size)
+        self.ring = RingBuffer(capacity)
+        if sink is None:
+            options = {"path": output_path} if output_sink == "file" else {}
+            sink = sinks[output_sink](sample_rate=sample_rate, block_size=block_size, channels=channels, **options)
+        self.sink = sink
+
+    # how long (in seconds) a block waits between being rendered and being heard, at most: the ring when it's full,
+    # then the sound card's own buffers.
+    @property
+    def latency(self):
+        return self.fill_target / channels / sample_rate + self.sink.latency()
+
+    # with adaptive_latency, after every block: gives the tuner how long it took, and switches to the block size and
+    # blocks ahead it wants if they've changed. this is on the render thread, so nothing's printed: the latency it's
+    # at now is the latency property, and the stats log reports it.
+    def adapt(self, render_time):
+        tuner = self.tuner
+        if not tuner.update(render_time, self.block_frames, self.ring.underruns):
+            return
+        self.block_frames = tuner.block_size
+        self.block_samples = tuner.block_size * channels
+        self.fill_target = self.block_samples * tuner.blocks_ahead
+        if self.stats is not None:
+            self.stats.latency = self.latency
+
+    # renders the next block straight into the ring, unless it would wrap around the end of it.
+    def write_block(self, events=None):
+        view = self.ring.reserve(self.block_samples)
+        samples = self.get_samples(self.block_frames, events=events, out=view)
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.write(samples)
+        if view is None:
+            self.ring.write(samples)
+        else:
+            self.ring.commit(self.block_samples)
+
+    # records everything that's played from now on into a wav file at path. the file is written on a thread of its
+    # own, so this can be called from any thread and the render thread never waits for the disk.
+    def start_recording(self, path):
+        self.stop_recording()
+        self.recorder = WavRecorder(path, sample_rate=sample_rate, channels=channels).start()
+
+    def stop_recording(self):
+        recorder = self.recorder
+        if recorder is not None:
+            self.recorder = None
+            recorder.stop()
+            if recorder.dropped:
+                print("the recording lost {} frames that couldn't be written in time".format(recorder.dropped))
 
     def play(self):
-        # gets the input and plays the notes
-        # these functions prevent add_key from continuously firing when the key is held down. DeBounce.
+        # keyboard hooks the keys for the whole system (which needs root on linux), so it's only imported once the
+        # synth is actually being played.
+        import keyboard
+
+        # gets the input and plays the notes. these run on the keyboard thread, so they only queue the notes up for
+        # the render thread, which gives them the gui's envelope. held keeps add_key from continuously firing when the
+        # key is held down. DeBounce.
+        held = set()
+
         def remove_key(e):
             key = str.lower(e.name)
-            keyboard.on_press_key(key, add_key)
-            if key in self.notes_dict:
-                self.notes_dict[key][0].trigger_release()
-                self.notes_dict[key][1] = True
+            held.discard(key)
+            self.events.push("note_off", key)
 
         def add_key(e):
             key = str.lower(e.name)
-            # only adds it if it isn't there before.
-            if not (key in self.notes_dict) or self.notes_dict[key][1]:
-                osc = Oscillator(freq=key_frequencies[key],
-                                 amp=0.2,
-                                 wave_shape=self.wave_shape
-                                 )
-                # a list of all the modulators for amplitude. Always contains ADSR, can contain additional ones.
-                amp_modulators = [ADSREnvelope(attack_duration=app.attack,
-                                               decay_duration=app.decay,
-                                               sustain_level=app.sustain,
-                                               release_duration=app.release,
-                                               sample_rate=sample_rate)]
-
-                pitch_modulators = []
-                # put in the selected LFOs
-                for lfo_index in current_amp_LFO:
-                    amp_modulators.append(LFOs[lfo_index])
-
-                for lfo_index in current_pitch_LFO:
-                    pitch_modulators.append(LFOs[lfo_index])
-
-                # for lfo_index in current_phase_LFO:
-                #     phase_modulators.append(LFOs[lfo_index])
-
-                # sets the frequency incase the pitch slider is not at 1.
-                # osc.freq = osc.init_freq * app.pitch
-
-                self.notes_dict[key] = [ModulatedOscillator(osc,
-                                                            amp_modulators=amp_modulators,
-                                                            freq_modulators=pitch_modulators,
-                                                            # phase_modulators=phase_modulators,
-                                                            freq_scale=app.pitch
-                                                            ),
-                                        False]
+            if key in held:
+                return
+            held.add(key)
+            self.events.push("note_on", key, key_notes[key], 0.2)
 
         # bind all the keys:
-        for note in key_frequencies:
-            keyboard.on_release_key(note, remove_key)
-            keyboard.on_press_key(note, add_key)
+        for key in key_notes:
+            keyboard.on_release_key(key, remove_key)
+            keyboard.on_press_key(key, add_key)
 
-        while True:
-            if self.notes_dict:
-                # Play the notes
-                samples = self.get_samples(self.notes_dict)
-                self.stream.write(samples.tobytes())
-            else:
-                # I have to yield it a bit or else it will be very glitchy.
-                time.sleep(0.01)
+        if self.midi_input is not None:
+            self.midi_input.start()
+        if record_path is not None:
+            self.start_recording(record_path)
+
+        # fill the ring up before the sink starts pulling from it.
+        while self.ring.available() + self.block_samples <= self.fill_target:
+            self.write_block()
+        self.sink.start(self.ring)
+        if self.stats is not None:
+            self.stats.start()
 
-            # checks if any of the notes have been released AND have finished their release envelope.
-            ended_notes = [k for k, o in self.notes_dict.items() if o[0].ended and o[1]]
-            for note in ended_notes:
-                del self.notes_dict[note]
+        while True:
+            # renders the next block as soon as there's room for it under fill_target (silence if no notes are
+            # playing), so a new note is only ever blocks_ahead blocks away from being heard. voices that have finished
+            # their release are removed by the bank.
+            if self.ring.wait_for_space(self.ring.capacity - self.fill_target + self.block_samples, timeout=0.1):
+                start = time.perf_counter()
+                stats = self.stats
+                if stats is not None:
+                    stats.start_block()
+                num_frames = self.block_frames
+                events = self.events.drain(num_frames, sample_rate)
+                if self.midi_player is not None:
+                    events += self.midi_player.drain(num_frames, sample_rate)
+                if stats is not None:
+                    stats.mark("events")
+                self.write_block(events)
+                if stats is not None:
+                    stats.mark("write")
+                    stats.end_block(num_frames, self.voices.count)
+                if self.tuner is not None:
+                    self.adapt(time.perf_counter() - start)
 
             if self.stopping:
                 print("Stopping!")
-                del self.notes_dict
+                if self.midi_input is not None:
+                    self.midi_input.stop()
+                self.stop_recording()
+                self.sink.stop()
+                if self.stats is not None:
+                    self.stats.stop()
+                self.close()
                 break
 
     def stop(self):
@@ -253,79 +300,100 @@ class Synthesizer(threading.Thread):
 # # the main gui
 # root = CTk()
 
-class SynthesizerGui(App.Window):
-    def onAmpChanged(self, *_):
-        self.amp = self.amp_slider.get() / 100
-        synth.amp = self.amp
-
-    def onPitchChanged(self, *_):
-        # pitch_factor = pow(2, self.pitch_slider.get() / 100)  # turns it in to a factor to multiply the base frequency by.
-        pitch_factor = self.pitch_slider.get() / 100
-        synth.update_pitch(pitch_factor)  # thread kinda needs to be defined before this is created, *shrug*
-        self.pitch = pitch_factor
-
-    # def onPhaseChanged(self, *_):
-    #     pass
-        # do something
-
-    # closing function which terminates the processes
-    def on_closing(self):
-        self.destroy()
-        synth.stop()
-        exit()
-
-    def shape_changed(self, index):
-        # doesn't fire twice if index is the same
-        if self.wave_shape == index:
-            return
-        # changes the sound to whatever index it is
-        synth.change_shape(shape_index=index)
-        self.wave_shape = index
-
-    def amp_LFO_changed(self, lfo_index):
-        global current_amp_LFO
-        # if it is already set and clicked again, remove it.
-        if lfo_index in current_amp_LFO:
-            list.remove(current_amp_LFO, lfo_index)
-        else:
-            current_amp_LFO.append(lfo_index)
-
-    def pitch_LFO_changed(self, lfo_index):
-        global current_pitch_LFO
-        # if it is already set and clicked again, remove it.
-        if lfo_index in current_pitch_LFO:
-            list.remove(current_pitch_LFO, lfo_index)
-        else:
-            current_pitch_LFO.append(lfo_index)
-
-    # def phase_LFO_changed(self, lfo_index):
-    #     global current_phase_LFO
-    #     # if it is already set and clicked again, remove it.
-    #     if lfo_index in current_phase_LFO:
-    #         list.remove(current_phase_LFO, lfo_index)
-    #     else:
-    #         current_phase_LFO.append(lfo_index)
-    #     print("LFO for pitch changed to ")
-    #     print(current_phase_LFO)
-
-    def onPeriodChanged(self, periodVal, lfo_index):
-        global LFOs
-        # change the period/frequency for the amplitude
-        try:
-            newFreq = 1 / float(periodVal.get())
-        except:
-            # don't change it if it is invalid
-            return
-            # period.set(oldFreq)
-        # change the frequency
-        LFOs[lfo_index].freq = newFreq
+# the gui, made when the synth is played live. App needs customtkinter and a display, which nothing else here does,
+# so it's only imported once the window is wanted.
+#
+# it never touches the synth directly, since that's being rendered on another thread: every change goes into
+# synth.params, and the render thread picks them up at the start of its next block.
+def make_gui():
+    from . import App
+
+    class SynthesizerGui(App.Window):
+        def onAmpChanged(self, *_):
+            self.amp = self.amp_slider.get() / 100
+            synth.params.set("amp", self.amp)
+
+        def onPitchChanged(self, *_):
+            # pitch_factor = pow(2, self.pitch_slider.get() / 100)  # turns it in to a factor to multiply the base frequency by.
+            pitch_factor = self.pitch_slider.get() / 100
+            synth.params.set("pitch", pitch_factor)
+            self.pitch = pitch_factor
+
+        # the sliders are read here, on the gui thread, so nothing else ever has to call into tk.
+        def onEnvelopeChanged(self, *_):
+            synth.params.update({"attack": self.attack, "decay": self.decay, "sustain": self.sustain,
+                                 "release": self.release})
+
+        # def onPhaseChanged(self, *_):
+        #     pass
+            # do something
+
+        # closing function which terminates the processes
+        def on_closing(self):
+            self.destroy()
+            synth.stop()
+            exit()
+
+        def shape_changed(self, index):
+            # doesn't fire twice if index is the same
+            if self.wave_shape == index:
+                return
+            # changes the sound to whatever index it is
+            synth.params.set("wave_shape", index)
+            self.wave_shape = index
+
+        # turns an LFO on for amp_lfos or pitch_lfos, or off if it is already on.
+        def toggle_LFO(self, name, lfo_index):
+            lfos = list(synth.params[name])
+            # if it is already set and clicked again, remove it.
+            if lfo_index in lfos:
+                lfos.remove(lfo_index)
+            else:
+                lfos.append(lfo_index)
+            synth.params.set(name, tuple(lfos))
+
+        def amp_LFO_changed(self, lfo_index):
+            self.toggle_LFO("amp_lfos", lfo_index)
+
+        def pitch_LFO_changed(self, lfo_index):
+            self.toggle_LFO("pitch_lfos", lfo_index)
+
+        # def phase_LFO_changed(self, lfo_index):
+        #     global current_phase_LFO
+        #     # if it is already set and clicked again, remove it.
+        #     if lfo_index in current_phase_LFO:
+        #         list.remove(current_phase_LFO, lfo_index)
+        #     else:
+        #         current_phase_LFO.append(lfo_index)
+        #     print("LFO for pitch changed to ")
+        #     print(current_phase_LFO)
+
+        def onPeriodChanged(self, periodVal, lfo_index):
+            # change the period/frequency for the amplitude
+            try:
+                newFreq = 1 / float(periodVal.get())
+            except:
+                # don't change it if it is invalid
+                return
+                # period.set(oldFreq)
+            # change the frequency
+            freqs = list(synth.params["lfo_freqs"])
+            freqs[lfo_index] = newFreq
+            synth.params.set("lfo_freqs", tuple(freqs))
+
+    gui = SynthesizerGui()
+    # the envelope the sliders start at
+    gui.onEnvelopeChanged()
+    if synth.scope is not None:
+        gui.start_scope(synth.scope)
+    return gui
 
 
 if __name__ == '__main__':
     # the keyboard inputs and playing sounds
     synth = Synthesizer()
     # start the gui
-    app = SynthesizerGui()
+    app = make_gui()
     # start the synthesizer
     synth.start()
     # mainloop required for the gui